@@ -1,15 +1,43 @@
 import os
 import re
+import pathlib
 import threading
 import time
+import bisect
+import itertools
+import multiprocessing
+import sys
+import gzip
 import json
+import hashlib
 import sqlite3
+import tempfile
+import mimetypes
+import atexit
+import heapq
+import math
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Tuple
+from types import MappingProxyType
+from typing import Callable, Dict, List, Any, Iterable, Iterator, Mapping, NamedTuple, Optional, Tuple
 
-from flask import Flask, jsonify, request, render_template, Response, stream_with_context, make_response, send_from_directory
-import pandas as pd
+from flask import Flask, Request, jsonify, request, render_template, Response, stream_with_context, make_response
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:  # optional: brotli variants are only precomputed when the module is installed
+    import brotli
+except ImportError:
+    brotli = None
+
+from excel_worker import EntryRow, open_workbook, parse_sheet, rows_to_entries, word_column
 
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
@@ -23,13 +51,49 @@ TXT_EXTENSIONS = {".txt"}
 EXCEL_EXTENSIONS = {".xlsx", ".xls"}
 DATA_DIR = os.path.join(BASE_DIR, "data_sentence")
 SQLITE_DB_PATH = os.path.join(DATA_DIR, "coca.sqlite")
+SHADOW_DB_PATH = os.path.join(DATA_DIR, "coca.sqlite.shadow")  # incremental builds land here first
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024  # read-only lookups map the dictionary db
+LOOKUP_IN_MEMORY = True  # answer lookups from DictionaryIndex instead of SQLite
 STATE_FILE_PATH = os.path.join(DATA_DIR, "loading_state.json")
+VOCAB_DIR = os.path.join(BASE_DIR, "data_vocabulary")
+VOCAB_SQLITE_PATH = os.path.join(DATA_DIR, "vocab.sqlite")
+IMPORT_CHUNK_ROWS = 5000  # bulk pipeline: rows per normalize/executemany/progress step
+IMPORT_PIPELINES = ("bulk", "legacy", "parallel")
+# Requests that block hold a waitress thread each. Their caps (progress streams,
+# AI calls and followers, chat long-polls) add up to 8 of WAITRESS_THREADS, so
+# lookups and plain chat requests always keep at least 2.
+WAITRESS_THREADS = 10
+EXCEL_STREAM_MAX_WATCHERS = 1  # /api/excel/stream connections at once
+IMPORT_WORKERS = max(1, min(4, os.cpu_count() or 1))  # parallel pipeline process count
+# spawned import workers re-run the parent's __main__ script, which may import this
+# module; skip its startup side effects (chat db init, state file reads/writes) there.
+# parent_process() is only set after that bootstrap, _inheriting covers it.
+IMPORT_WORKER_PROCESS = (
+    __name__ == "__mp_main__"
+    or multiprocessing.parent_process() is not None
+    or bool(getattr(multiprocessing.current_process(), "_inheriting", False))
+)
+AI_API_BASE_URL = "https://api.siliconflow.cn/v1"  # point at a local stand-in server for testing
+AI_POOL_SIZE = 10  # keep-alive upstream connections (one per waitress thread)
+AI_CONNECT_TIMEOUT = 10.0
+AI_READ_TIMEOUT = 60.0
+AI_CACHE_PATH = os.path.join(DATA_DIR, "ai_cache.sqlite")
+AI_CACHE_TTL = 7 * 24 * 3600  # seconds a cached AI reply stays valid
+AI_CACHE_MAX_BYTES = 32 * 1024 * 1024  # least recently used replies are evicted past this
+AI_CACHE_TOUCH_INTERVAL = 30.0  # seconds between batched writes of cache-hit access times
+# AI requests hold at most AI_MAX_ACTIVE + AI_MAX_QUEUED + AI_MAX_FOLLOWERS threads
+AI_MAX_ACTIVE = 2
+AI_MAX_QUEUED = 1
+AI_MAX_FOLLOWERS = 1  # requests waiting on an identical in-flight request's reply
+AI_SESSION_LIMIT = 1  # concurrent (active, queued or following) AI requests per browser session
+AI_QUEUE_TIMEOUT = 10.0  # seconds a queued request waits before a 503
 
 # -----------------------------
 # Chat Config
 # -----------------------------
 DATA_CHAT_DIR = os.path.join(BASE_DIR, "data_chat")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, ".incoming")  # same filesystem, so blobs move with os.replace
 CHAT_SQLITE_PATH = os.path.join(DATA_CHAT_DIR, "chat.sqlite")
 COOKIE_NAME_PREFIX = "chat_"
 ONLINE_SESSION_TIMEOUT = 300  # seconds
@@ -48,31 +112,672 @@ ALLOWED_EXTENSIONS = {
 }
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
-# In-memory state for chat
-online_users: Dict[str, Dict[str, Any]] = {}
-
 # Locks and cache
 file_locks = {
     "messages": threading.RLock(),
     "version": threading.RLock(),
 }
 
+CHAT_RECENT_LIMIT = 100  # /msg never returns more than this many messages
+CHAT_WAIT_TIMEOUT = 25.0  # seconds a /msg/wait long-poll may block
+CHAT_MAX_WAITERS = 3  # long-polls allowed to block at once (see WAITRESS_THREADS)
+CHAT_BUFFER_LIMIT = 1000  # messages kept in memory and in chat_messages
+CHAT_FLUSH_DELAY = 0.2  # write-behind linger so a burst of messages commits once
+# "local": chat state lives in this process only.
+# "sqlite": presence, version and messages are shared through chat.sqlite so
+# several server processes can serve the chat together.
+CHAT_STATE_BACKEND = "local"
+CHAT_SYNC_INTERVAL = 0.25  # sqlite backend: how often to check for other processes' commits
+CHAT_COMMIT_LINGER = 0.005  # sqlite backend: group-commit window for concurrent writers
+
 message_cache: Dict[str, Any] = {
     "version": 0,
+    "last_id": 0,  # highest chat_messages.id, lets /msg answer "nothing new" without SQL
+    # sender names of the latest CHAT_RECENT_LIMIT messages (None for non-chat rows)
+    "recent_names": deque(maxlen=CHAT_RECENT_LIMIT),
 }
 
-# 简化：仅内存维护站点在线会话
-online_sessions_lock = threading.Lock()
-online_sessions: Dict[str, float] = {}
+class ChatNotifier:
+    """Wakes /msg/wait long-polls when messages or the version change.
+
+    Only ``max_waiters`` requests may block at a time; further listeners are
+    told to fall back to interval polling, so long-polls can never occupy
+    every waitress worker thread.
+    """
+
+    def __init__(self, max_waiters: int = CHAT_MAX_WAITERS):
+        self.cond = threading.Condition()
+        self.max_waiters = max_waiters
+        self.waiters = 0
+        self.revision = 0
+
+    def notify(self) -> None:
+        with self.cond:
+            self.revision += 1
+            self.cond.notify_all()
+
+    def try_enter(self) -> bool:
+        with self.cond:
+            if self.waiters >= self.max_waiters:
+                return False
+            self.waiters += 1
+            return True
+
+    def leave(self) -> None:
+        with self.cond:
+            self.waiters -= 1
+
+    def wait_for(self, predicate, timeout: float) -> bool:
+        with self.cond:
+            return self.cond.wait_for(predicate, timeout)
+
+
+chat_notifier = ChatNotifier()
+
+
+class ChatMessageBuffer:
+    """In-memory ring of the newest chat messages, stored pre-serialized.
+
+    The buffer is the source of truth for reads and assigns message ids itself;
+    a background writer copies new messages to ``chat_messages`` in one
+    transaction per burst and trims the table by id arithmetic.
+    """
+
+    def __init__(self, limit: int = CHAT_BUFFER_LIMIT, flush_delay: float = CHAT_FLUSH_DELAY):
+        self.limit = limit
+        self.flush_delay = flush_delay
+        self.lock = threading.Lock()
+        self.items: deque = deque(maxlen=limit)  # (id, content), oldest first
+        self.last_id = 0
+        self.pending: List[Tuple[int, str]] = []
+        self.clear_pending = False
+        self.clears = 0  # bumped by clear()/load(); a failed batch from before is dropped
+        self.version_pending: Optional[int] = None
+        self.flush_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def load(self, rows: List[Tuple[int, str]], last_id: int) -> None:
+        with self.lock:
+            self.items.clear()
+            self.items.extend(rows[-self.limit:])
+            self.last_id = max(last_id, rows[-1][0] if rows else 0)
+            self.pending = []
+            self.clear_pending = False
+            self.clears += 1
+            self.version_pending = None
+
+    def append_many(self, contents: List[str], version: Optional[int] = None) -> List[int]:
+        """Queue messages (and optionally a version) so they are flushed together."""
+        with self.lock:
+            start = self.last_id + 1
+            self.last_id += len(contents)
+            items = list(zip(range(start, self.last_id + 1), contents))
+            self.items.extend(items)
+            self.pending.extend(items)
+            if version is not None:
+                self.version_pending = version
+        self._schedule()
+        return [i for i, _ in items]
+
+    def extend(self, rows: List[Tuple[int, str]]) -> None:
+        """Append rows another writer already persisted (no write-behind)."""
+        with self.lock:
+            for item in rows:
+                if item[0] > self.last_id:
+                    self.items.append(item)
+                    self.last_id = item[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+            self.pending = []
+            self.clear_pending = True
+            self.clears += 1
+        self._schedule()
+
+    def count(self) -> int:
+        return len(self.items)
+
+    def latest(self, limit: int) -> List[Tuple[int, str]]:
+        with self.lock:
+            n = len(self.items)
+            return list(itertools.islice(self.items, max(0, n - limit), n))
+
+    def since(self, last_id: int, limit: int = CHAT_RECENT_LIMIT) -> List[Tuple[int, str]]:
+        """Keyset read: the newest ``limit`` messages with id > last_id, oldest first."""
+        with self.lock:
+            if last_id >= self.last_id:
+                return []
+            # walk back from the newest entry: cost is the number of new messages
+            out = []
+            for item in reversed(self.items):
+                if item[0] <= last_id or len(out) >= limit:
+                    break
+                out.append(item)
+            out.reverse()
+            return out
+
+    def _schedule(self) -> None:
+        if self.thread is None or not self.thread.is_alive():
+            with self.start_lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                    self.thread.start()
+        self.wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self.wake.wait()
+            time.sleep(self.flush_delay)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Chat flush failed")
+
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                clear, self.clear_pending = self.clear_pending, False
+                version, self.version_pending = self.version_pending, None
+                clears = self.clears
+            if not batch and not clear and version is None:
+                return
+            con = sqlite3.connect(CHAT_SQLITE_PATH)
+            try:
+                with con:
+                    if clear:
+                        con.execute("DELETE FROM chat_messages")
+                    if batch:
+                        con.executemany("INSERT INTO chat_messages(id, content) VALUES(?, ?)", batch)
+                        con.execute("DELETE FROM chat_messages WHERE id <= ?", (batch[-1][0] - self.limit,))
+                    if version is not None:
+                        con.execute("UPDATE chat_meta SET value=? WHERE key='version'", (str(version),))
+            except Exception:
+                # put the batch back so the next flush retries it, unless it was cleared meanwhile
+                with self.lock:
+                    if self.clears == clears:
+                        self.pending = batch + self.pending
+                    self.clear_pending = self.clear_pending or clear
+                    if self.version_pending is None:
+                        self.version_pending = version
+                raise
+            finally:
+                con.close()
+
+
+chat_buffer = ChatMessageBuffer()
+atexit.register(chat_buffer.flush)
+
+
+class ChatResponseCache:
+    """Encoded /msg bodies for the current (version, last_id).
+
+    Between two chat events every poller with the same ``since`` receives
+    identical bytes, so each body is serialized and compressed once.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.key: Optional[Tuple[int, int]] = None
+        self.bodies: Dict[Any, "EncodedBody"] = {}
+
+    def get(self, key: Tuple[int, int], variant: Any, build) -> "EncodedBody":
+        with self.lock:
+            if key != self.key:
+                self.key = key
+                self.bodies = {}
+            body = self.bodies.get(variant)
+        if body is None:
+            body = build()
+            with self.lock:
+                if self.key == key and len(self.bodies) < self.max_entries:
+                    self.bodies[variant] = body
+        return body
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.key = None
+            self.bodies = {}
+
+
+chat_responses = ChatResponseCache()
+
+class PresenceTracker:
+    """Last-seen times plus an expiry heap, so counting is O(1) and expiring is
+    O(k log n) for k expired keys instead of a scan over everyone.
+
+    The heap holds at most one (deadline, key) entry per key, the one recorded
+    in ``queued``; an entry whose key was touched since it was pushed is
+    re-pushed with the real deadline when it surfaces, and an entry whose key
+    was discarded is dropped.
+    """
+
+    def __init__(self, timeout: float = ONLINE_SESSION_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.seen: Dict[str, float] = {}
+        self.names: Dict[str, str] = {}
+        self.heap: List[Tuple[float, str]] = []
+        self.queued: Dict[str, float] = {}  # key -> deadline of its heap entry
+
+    def touch(self, key: str, now: Optional[float] = None, name: Optional[str] = None) -> None:
+        now = time.time() if now is None else now
+        with self.lock:
+            if key not in self.queued:
+                self.queued[key] = now + self.timeout
+                heapq.heappush(self.heap, (now + self.timeout, key))
+            self.seen[key] = now
+            if name is not None:
+                self.names[key] = name
+        presence_reaper.start()
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            self.seen.pop(key, None)
+            self.names.pop(key, None)
+
+    def name(self, key: str) -> str:
+        return self.names.get(key, "")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.seen
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def next_deadline(self) -> Optional[float]:
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Drop keys past their deadline; returns (key, name) pairs."""
+        now = time.time() if now is None else now
+        expired: List[Tuple[str, str]] = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                pushed, key = heapq.heappop(self.heap)
+                if self.queued.get(key) != pushed:
+                    continue
+                seen = self.seen.get(key)
+                if seen is None:
+                    del self.queued[key]  # discarded since it was pushed
+                    continue
+                deadline = seen + self.timeout
+                if deadline > now:
+                    self.queued[key] = deadline
+                    heapq.heappush(self.heap, (deadline, key))
+                else:
+                    del self.queued[key]
+                    del self.seen[key]
+                    expired.append((key, self.names.pop(key, "")))
+        return expired
+
+
+class SqlitePresenceTracker:
+    """PresenceTracker kept in the chat_presence table, shared by all processes.
+
+    Heartbeats rewrite a row at most every ``timeout / 10`` seconds, and the
+    count is cached until this or another process commits a change.
+    """
+
+    def __init__(self, state: "SqliteChatState", scope: str, timeout: float = ONLINE_SESSION_TIMEOUT):
+        self.state = state
+        self.scope = scope
+        self.timeout = timeout
+        self.write_interval = timeout / 10
+        self.written: Dict[str, float] = {}
+        self.count: Optional[int] = None
+
+    def touch(self, key: str, now: Optional[float] = None, name: Optional[str] = None) -> None:
+        now = time.time() if now is None else now
+        if name is None and now - self.written.get(key, 0.0) < self.write_interval:
+            return
+        with self.state.transaction() as con:
+            con.execute(
+                "INSERT INTO chat_presence(scope, key, name, last_seen) VALUES(?, ?, ?, ?) "
+                "ON CONFLICT(scope, key) DO UPDATE SET last_seen=excluded.last_seen, "
+                "name=COALESCE(excluded.name, chat_presence.name)",
+                (self.scope, key, name, now),
+            )
+        self.written[key] = now
+        self.count = None
+        presence_reaper.start()
+
+    def discard(self, key: str) -> None:
+        with self.state.transaction() as con:
+            con.execute("DELETE FROM chat_presence WHERE scope=? AND key=?", (self.scope, key))
+        self.written.pop(key, None)
+        self.count = None
+
+    def name(self, key: str) -> str:
+        rows = self.state.query("SELECT name FROM chat_presence WHERE scope=? AND key=?", (self.scope, key))
+        return (rows[0][0] or "") if rows else ""
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.state.query("SELECT 1 FROM chat_presence WHERE scope=? AND key=?", (self.scope, key)))
+
+    def __len__(self) -> int:
+        count = self.count
+        if count is None:
+            count = self.state.query("SELECT COUNT(*) FROM chat_presence WHERE scope=?", (self.scope,))[0][0]
+            self.count = count
+        return count
+
+    def invalidate(self) -> None:
+        self.count = None
+
+    def next_deadline(self) -> Optional[float]:
+        rows = self.state.query("SELECT MIN(last_seen) FROM chat_presence WHERE scope=?", (self.scope,))
+        return rows[0][0] + self.timeout if rows and rows[0][0] is not None else None
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Delete expired rows in one write transaction, so only one process reports them."""
+        now = time.time() if now is None else now
+        cutoff = now - self.timeout
+        with self.state.transaction() as con:
+            expired = con.execute(
+                "SELECT key, name FROM chat_presence WHERE scope=? AND last_seen <= ?", (self.scope, cutoff)
+            ).fetchall()
+            if expired:
+                con.execute("DELETE FROM chat_presence WHERE scope=? AND last_seen <= ?", (self.scope, cutoff))
+        for key in [k for k, ts in list(self.written.items()) if ts <= cutoff]:
+            self.written.pop(key, None)
+        if expired:
+            self.count = None
+        return [(key, name or "") for key, name in expired]
+
+
+class PresenceReaper:
+    """The single background thread that expires site and chat presence."""
+
+    def __init__(self, min_sleep: float = 1.0):
+        self.min_sleep = min_sleep
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="presence-reaper", daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            deadlines = [d for d in (site_presence.next_deadline(), chat_presence.next_deadline()) if d is not None]
+            delay = min(deadlines) - time.time() if deadlines else ONLINE_SESSION_TIMEOUT
+            time.sleep(min(ONLINE_SESSION_TIMEOUT, max(self.min_sleep, delay)))
+            try:
+                site_presence.expire()
+                _update_online_status()
+            except Exception:
+                app.logger.exception("Presence sweep failed")
+
+
+presence_reaper = PresenceReaper()
+
+
+def _chat_read_snapshot(con: sqlite3.Connection) -> Tuple[List[Tuple[int, str]], int, int]:
+    """Newest CHAT_BUFFER_LIMIT messages, the id sequence and the version."""
+    rows = con.execute(
+        "SELECT id, content FROM chat_messages ORDER BY id DESC LIMIT ?", (CHAT_BUFFER_LIMIT,)
+    ).fetchall()
+    rows = [(int(i), c) for i, c in reversed(rows)]
+    # AUTOINCREMENT never reuses ids, even after the table was cleared
+    seq = con.execute("SELECT seq FROM sqlite_sequence WHERE name='chat_messages'").fetchone()
+    ver = con.execute("SELECT value FROM chat_meta WHERE key='version'").fetchone()
+    return (
+        rows,
+        int(seq[0]) if seq and seq[0] is not None else 0,
+        int(ver[0]) if ver and ver[0] is not None else 0,
+    )
+
+
+def _chat_reset_view(rows: List[Tuple[int, str]], last_id: int, version: int) -> None:
+    chat_buffer.load(rows, last_id)
+    with file_locks["version"]:
+        message_cache["version"] = version
+    with file_locks["messages"]:
+        message_cache["last_id"] = chat_buffer.last_id
+        message_cache["recent_names"].clear()
+        message_cache["recent_names"].extend(_message_sender(c) for _, c in rows[-CHAT_RECENT_LIMIT:])
+    chat_responses.invalidate()
+    chat_notifier.notify()
+
+
+def _chat_absorb(rows: List[Tuple[int, str]]) -> None:
+    # 调用方持有 file_locks["messages"]
+    if rows:
+        message_cache["last_id"] = max(message_cache["last_id"], rows[-1][0])
+        message_cache["recent_names"].extend(_message_sender(c) for _, c in rows)
+
+
+class _ChatWrite:
+    __slots__ = ("contents", "bump_version", "ids", "version", "error", "done")
+
+    def __init__(self, contents: List[str], bump_version: bool):
+        self.contents = contents
+        self.bump_version = bump_version
+        self.ids: List[int] = []
+        self.version = 0
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+
+class LocalChatState:
+    """Chat state owned by this process: the ring with write-behind and
+    in-memory presence."""
+
+    name = "local"
+
+    def __init__(self):
+        self.site = PresenceTracker()
+        self.chat = PresenceTracker()
+
+    def load(self, con: sqlite3.Connection) -> None:
+        _chat_reset_view(*_chat_read_snapshot(con))
+
+    def write(self, contents: List[str], bump_version: bool = False) -> Tuple[List[int], int]:
+        """Append messages and optionally bump the version; both reach SQLite
+        in the same write-behind transaction. Returns (ids, version)."""
+        with file_locks["messages"], file_locks["version"]:
+            version = message_cache["version"] + (1 if bump_version else 0)
+            ids = chat_buffer.append_many(contents, version if bump_version else None)
+            message_cache["version"] = version
+            _chat_absorb(list(zip(ids, contents)))
+        return ids, version
+
+    def clear(self) -> None:
+        chat_buffer.clear()
+
+
+class SqliteChatState:
+    """Chat state shared by every server process through chat.sqlite (WAL).
+
+    Writes go straight to the database so ids and the version are assigned
+    there. Each process keeps the ring as a read view and catches up when
+    ``PRAGMA data_version`` reports a commit from another connection.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, sync_interval: float = CHAT_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.lock = threading.RLock()
+        self.con: Optional[sqlite3.Connection] = None
+        self.data_version: Optional[int] = None
+        self.epoch: Optional[int] = None
+        self.thread: Optional[threading.Thread] = None
+        self.linger = CHAT_COMMIT_LINGER
+        self.write_cond = threading.Condition()
+        self.write_queue: List[_ChatWrite] = []
+        self.committing = False
+        self.site = SqlitePresenceTracker(self, "site")
+        self.chat = SqlitePresenceTracker(self, "chat")
+
+    def _db(self) -> sqlite3.Connection:
+        if self.con is None:
+            self.con = sqlite3.connect(CHAT_SQLITE_PATH, check_same_thread=False, isolation_level=None)
+            self.con.execute("PRAGMA busy_timeout=5000")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+        return self.con
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            con = self._db()
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self.lock:
+            return self._db().execute(sql, params).fetchall()
+
+    def _epoch(self, con: sqlite3.Connection) -> int:
+        row = con.execute("SELECT value FROM chat_meta WHERE key='epoch'").fetchone()
+        return int(row[0]) if row and row[0] is not None else 0
+
+    def load(self, con: sqlite3.Connection) -> None:
+        self.refresh(force=True)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="chat-sync", daemon=True)
+            self.thread.start()
+
+    def refresh(self, force: bool = False) -> bool:
+        """Catch up with commits made by other processes; True when anything changed."""
+        with self.lock:
+            con = self._db()
+            data_version = con.execute("PRAGMA data_version").fetchone()[0]
+            if not force and data_version == self.data_version:
+                return False
+            self.data_version = data_version
+            epoch = self._epoch(con)
+            if epoch != self.epoch:
+                # cleared (or first load): rebuild the whole view
+                self.epoch = epoch
+                snapshot = _chat_read_snapshot(con)
+                rows = None
+            else:
+                snapshot = None
+                rows = [(int(i), c) for i, c in con.execute(
+                    "SELECT id, content FROM chat_messages WHERE id > ? ORDER BY id", (chat_buffer.last_id,)
+                )]
+                ver = con.execute("SELECT value FROM chat_meta WHERE key='version'").fetchone()
+                version = int(ver[0]) if ver and ver[0] is not None else 0
+        self.site.invalidate()
+        self.chat.invalidate()
+        if snapshot is not None:
+            _chat_reset_view(*snapshot)
+            return True
+        with file_locks["messages"]:
+            chat_buffer.extend(rows)
+            _chat_absorb(rows)
+        with file_locks["version"]:
+            message_cache["version"] = version
+        chat_notifier.notify()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.refresh()
+            except Exception:
+                app.logger.exception("Chat sync failed")
+
+    def write(self, contents: List[str], bump_version: bool = False) -> Tuple[List[int], int]:
+        """Group commit: writers arriving within ``linger`` of each other share
+        one transaction, one trim and at most one version bump. The first
+        writer commits for everyone queued; the rest wait for their ids."""
+        req = _ChatWrite(contents, bump_version)
+        with self.write_cond:
+            self.write_queue.append(req)
+            while not req.done and self.committing:
+                self.write_cond.wait()
+            leader = not req.done
+            if leader:
+                self.committing = True
+        if leader:
+            time.sleep(self.linger)
+            with self.write_cond:
+                batch, self.write_queue = self.write_queue, []
+            try:
+                self._commit(batch)
+                self.refresh(force=True)
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            finally:
+                with self.write_cond:
+                    for r in batch:
+                        r.done = True
+                    self.committing = False
+                    self.write_cond.notify_all()
+        if req.error is not None:
+            raise req.error
+        return req.ids, req.version
+
+    def _commit(self, batch: List["_ChatWrite"]) -> None:
+        with self.transaction() as con:
+            last_id = 0
+            for r in batch:
+                r.ids = [
+                    int(con.execute("INSERT INTO chat_messages(content) VALUES(?)", (c,)).lastrowid)
+                    for c in r.contents
+                ]
+                if r.ids:
+                    last_id = r.ids[-1]
+            if last_id:
+                con.execute("DELETE FROM chat_messages WHERE id <= ?", (last_id - CHAT_BUFFER_LIMIT,))
+            if any(r.bump_version for r in batch):
+                con.execute("UPDATE chat_meta SET value=CAST(value AS INTEGER) + 1 WHERE key='version'")
+            version = int(con.execute("SELECT value FROM chat_meta WHERE key='version'").fetchone()[0])
+        for r in batch:
+            r.version = version
+
+    def clear(self) -> None:
+        with self.transaction() as con:
+            con.execute("DELETE FROM chat_messages")
+            con.execute("UPDATE chat_meta SET value=CAST(value AS INTEGER) + 1 WHERE key='epoch'")
+        self.refresh(force=True)
+
+
+
+chat_state = SqliteChatState() if CHAT_STATE_BACKEND == "sqlite" else LocalChatState()
+# 站点在线会话与聊天室在线用户
+site_presence = chat_state.site
+chat_presence = chat_state.chat
 
 
 def get_site_online_count() -> int:
     # 统一以聊天室在线用户为准
-    _update_online_status()
-    return len(online_users)
+    return len(chat_presence)
 
 
-# 仅保留内存在线会话，无持久化
+def _touch_chat_user(user_key: str) -> None:
+    if user_key in chat_presence:
+        chat_presence.touch(user_key)
+
+
+def _message_sender(content: str) -> Optional[str]:
+    try:
+        obj = json.loads(content)
+    except Exception:
+        return None
+    if isinstance(obj, dict) and obj.get("type") == "msg" and obj.get("name"):
+        return obj["name"]
+    return None
 
 
 def _chat_init_db() -> None:
@@ -98,13 +803,27 @@ def _chat_init_db() -> None:
             );
             """
         )
-        # Initialize version
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_presence (
+              scope TEXT NOT NULL,
+              key TEXT NOT NULL,
+              name TEXT,
+              last_seen REAL NOT NULL,
+              PRIMARY KEY (scope, key)
+            );
+            """
+        )
+        # Initialize version; epoch counts clears so other processes can rebuild their view
         cur.execute("INSERT OR IGNORE INTO chat_meta(key, value) VALUES('version','0')")
+        cur.execute("INSERT OR IGNORE INTO chat_meta(key, value) VALUES('epoch','0')")
         con.commit()
+        chat_state.load(con)
     finally:
         con.close()
 
-_chat_init_db()
+if not IMPORT_WORKER_PROCESS:
+    _chat_init_db()
 
 def _allowed_file(filename: str) -> bool:
     if "." not in filename:
@@ -124,37 +843,84 @@ def _get_file_type(filename: str) -> str:
             return file_type
     return "other"
 
-def _unique_filename(filename: str) -> str:
-    name, ext = os.path.splitext(filename)
-    return f"{int(time.time()*1000)}_{os.getpid()}{ext}"
+class HashingUploadFile:
+    """Stream factory target for one uploaded file.
 
-def _get_current_version() -> int:
-    with file_locks["version"]:
-        try:
-            con = sqlite3.connect(CHAT_SQLITE_PATH)
-            cur = con.cursor()
-            cur.execute("SELECT value FROM chat_meta WHERE key='version'")
-            row = cur.fetchone()
-            con.close()
-            version = int(row[0]) if row and row[0] is not None else 0
-            message_cache["version"] = version
-            return version
-        except Exception:
-            return 0
+    Bytes are hashed while werkzeug's multipart parser writes them, and the
+    size limit is enforced per chunk, so an oversized file is rejected
+    before it is fully spooled. Files with a disallowed extension are only
+    counted, never written.
+    """
 
-def _increment_version() -> int:
-    with file_locks["version"]:
-        cur_v = _get_current_version()
-        new_v = cur_v + 1
-        con = sqlite3.connect(CHAT_SQLITE_PATH)
-        try:
-            c = con.cursor()
-            c.execute("UPDATE chat_meta SET value=? WHERE key='version'", (str(new_v),))
-            con.commit()
-        finally:
-            con.close()
-        message_cache["version"] = new_v
-        return new_v
+    def __init__(self, filename: Optional[str], limit: int = MAX_FILE_SIZE):
+        self.limit = limit
+        self.size = 0
+        self.hash = hashlib.sha256()
+        self.path: Optional[str] = None
+        if filename and _allowed_file(filename):
+            os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR)
+            self.file = os.fdopen(fd, "w+b")
+        else:
+            self.file = tempfile.SpooledTemporaryFile(max_size=0)  # stays empty
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestEntityTooLarge(f"file exceeds {self.limit} bytes")
+        if self.path is None:
+            return len(data)
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.file, name)
+
+    def store(self, filename: str) -> str:
+        """Move the spooled bytes to UPLOAD_DIR under their content hash; returns the stored name."""
+        ext = os.path.splitext(filename)[1].lower()
+        stored = f"{self.hash.hexdigest()}{ext}"
+        target = os.path.join(UPLOAD_DIR, stored)
+        self.file.close()
+        if os.path.exists(target):
+            os.remove(self.path)  # duplicate: keep the existing blob
+        else:
+            os.replace(self.path, target)
+        self.path = None
+        return stored
+
+    def close(self) -> None:
+        self.file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class UploadRequest(Request):
+    """Request class whose multipart files stream into HashingUploadFile."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path != "/upload":
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = HashingUploadFile(filename)
+        # tracked here too: if parsing aborts, request.files never holds it
+        self.__dict__.setdefault("_upload_streams", []).append(stream)
+        return stream
+
+    def close(self) -> None:
+        super().close()
+        for stream in self.__dict__.pop("_upload_streams", []):
+            stream.close()
+
+
+app.request_class = UploadRequest
+
+def _get_current_version() -> int:
+    # 内存中的版本号是权威值，启动时由 _chat_init_db 载入
+    return message_cache["version"]
 
 def _rand_nick() -> str:
     adjectives = [
@@ -175,22 +941,22 @@ def _get_token() -> str:
     import random
     return str(int(time.time()*1000)) + str(random.randint(1000, 9999))
 
+def _system_message(msg: str) -> Dict[str, Any]:
+    return {"type": "sys", "msg": f"<span class=\"tips-warning\">{msg}</span>"}
+
 def _add_system_message(msg: str) -> None:
-    add_message({"type": "sys", "msg": f"<span class=\"tips-warning\">{msg}</span>"})
+    add_message(_system_message(msg))
 
 def _update_online_status() -> None:
-    now = time.time()
-    timeout_keys: List[str] = []
-    for uk, info in list(online_users.items()):
-        # 使用统一会话超时时间
-        if now - info.get("last_active", 0) > ONLINE_SESSION_TIMEOUT:
-            timeout_keys.append(uk)
-    for uk in timeout_keys:
-        username = online_users.get(uk, {}).get("name", "")
-        online_users.pop(uk, None)
-        _add_system_message(f"<strong>{username}</strong>已超时退出")
-        _add_system_message(f"<span class=\"tips-warning\">当前在线人数：{len(online_users)}</span>")
-        _increment_version()
+    # 由 presence-reaper 线程调用：一次清扫内的超时用户合并为一条系统消息
+    timeout_keys = chat_presence.expire()
+    if not timeout_keys:
+        return
+    who = "、".join(f"<strong>{name}</strong>" for _, name in timeout_keys)
+    add_messages(
+        [_system_message(f"{who}已超时退出 <span class=\"tips-warning\">当前在线人数：{len(chat_presence)}</span>")],
+        bump_version=True,
+    )
 
 def _clear_uploads() -> None:
     try:
@@ -205,54 +971,31 @@ def _clear_uploads() -> None:
         pass
 
 def chat_total_messages() -> int:
-    con = sqlite3.connect(CHAT_SQLITE_PATH)
-    try:
-        cur = con.cursor()
-        cur.execute("SELECT COUNT(*) FROM chat_messages")
-        (cnt,) = cur.fetchone()
-        return int(cnt or 0)
-    finally:
-        con.close()
+    return chat_buffer.count()
 
-def chat_fetch_messages(offset: int, limit: int = 1000) -> List[str]:
-    con = sqlite3.connect(CHAT_SQLITE_PATH)
-    try:
-        cur = con.cursor()
-        cur.execute("SELECT content FROM chat_messages ORDER BY id ASC LIMIT ? OFFSET ?", (int(limit), int(offset)))
-        rows = cur.fetchall()
-        return [r[0] for r in rows]
-    finally:
-        con.close()
+def chat_fetch_since(last_id: int, limit: int = CHAT_RECENT_LIMIT) -> List[Tuple[int, str]]:
+    return chat_buffer.since(last_id, limit)
+
+def chat_recent_users() -> List[str]:
+    return list(dict.fromkeys(n for n in list(message_cache["recent_names"]) if n))
+
+def add_messages(message_objs: List[Dict[str, Any]], bump_version: bool = False) -> Tuple[List[int], int]:
+    """Append messages (and optionally bump the version) as one write; returns (ids, version)."""
+    contents = [json.dumps(m, ensure_ascii=False, separators=(",", ":")) for m in message_objs]
+    ids, version = chat_state.write(contents, bump_version)
+    chat_notifier.notify()
+    return ids, version
 
 def add_message(message_obj: Dict[str, Any]) -> int:
-    content = json.dumps(message_obj, ensure_ascii=False, separators=(",", ":"))
-    con = sqlite3.connect(CHAT_SQLITE_PATH)
-    try:
-        cur = con.cursor()
-        cur.execute("INSERT INTO chat_messages(content) VALUES(?)", (content,))
-        con.commit()
-        # cap to latest 1000
-        cur.execute("SELECT COUNT(*) FROM chat_messages")
-        (cnt,) = cur.fetchone()
-        surplus = int(cnt or 0) - 1000
-        if surplus > 0:
-            cur.execute(
-                "DELETE FROM chat_messages WHERE id IN (SELECT id FROM chat_messages ORDER BY id ASC LIMIT ?)",
-                (surplus,),
-            )
-            con.commit()
-        return int(cnt or 0)
-    finally:
-        con.close()
+    ids, _ = add_messages([message_obj])
+    return ids[0]
 
 def clear_messages() -> None:
-    con = sqlite3.connect(CHAT_SQLITE_PATH)
-    try:
-        cur = con.cursor()
-        cur.execute("DELETE FROM chat_messages")
-        con.commit()
-    finally:
-        con.close()
+    with file_locks["messages"]:
+        chat_state.clear()
+        message_cache["recent_names"].clear()
+        chat_responses.invalidate()
+    chat_notifier.notify()
 
 
 class LoadingStateStore:
@@ -266,14 +1009,29 @@ class LoadingStateStore:
         "error": None,
         "latest_words": [],
         "timestamp": None,
+        "mode": None,
+        "changes": None,
+        "pipeline": None,
+        "elapsed_seconds": 0.0,
+        "rows_per_second": 0.0,
     }
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, max_watchers: int = EXCEL_STREAM_MAX_WATCHERS, persist: bool = True):
         self.path = path
+        self.persist = persist  # False in import workers: never read or write the state file
         self.lock = threading.Lock()
+        # watchers wait on this; every mutation bumps ``revision`` and notifies
+        self.changed = threading.Condition(self.lock)
+        self.revision = 0
+        self.max_watchers = max_watchers
+        self.watchers = 0
+        self._frame: Optional[Tuple[int, bool, str]] = None  # (revision, loaded, SSE frame)
         self.state: Dict[str, Any] = self.DEFAULT_STATE.copy()
         self._last_persist = 0.0
-        self._load_from_disk()
+        self._started = time.monotonic()
+        if persist:
+            with self.lock:
+                self._load_from_disk()
 
     def _load_from_disk(self) -> None:
         if not os.path.exists(self.path):
@@ -298,8 +1056,11 @@ class LoadingStateStore:
         self._persist_locked(force=True)
 
     def _persist_locked(self, force: bool = False) -> None:
+        # every mutation ends here, so this is also where watchers are woken
+        self.revision += 1
+        self.changed.notify_all()
         now = time.time()
-        if not force and (now - self._last_persist) < 0.5:
+        if not self.persist or (not force and (now - self._last_persist) < 0.5):
             return
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
         tmp_path = f"{self.path}.tmp"
@@ -309,11 +1070,49 @@ class LoadingStateStore:
         self._last_persist = now
 
     def snapshot(self) -> Dict[str, Any]:
+        # mutators replace latest_words/changes instead of editing them in place,
+        # so a shallow copy is a consistent snapshot
+        with self.lock:
+            return dict(self.state)
+
+    def sse_frame(self, loaded: bool) -> Tuple[int, str]:
+        """The current state as an SSE ``data:`` frame, encoded once per revision."""
+        with self.lock:
+            cached = self._frame
+            if cached is not None and cached[0] == self.revision and cached[1] == loaded:
+                return cached[0], cached[2]
+            state = {"loaded": loaded, **self.state}
+            frame = f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+            self._frame = (self.revision, loaded, frame)
+            return self.revision, frame
+
+    def mark_changed(self) -> None:
+        """Wake watchers for a change kept outside the state (DATA_LOADED)."""
+        with self.lock:
+            self.revision += 1
+            self.changed.notify_all()
+
+    def try_watch(self) -> bool:
+        # like ChatNotifier.try_enter: streams beyond max_watchers are turned away
+        with self.lock:
+            if self.watchers >= self.max_watchers:
+                return False
+            self.watchers += 1
+            return True
+
+    def unwatch(self) -> None:
+        with self.lock:
+            self.watchers -= 1
+
+    def wait_for_change(self, revision: int, timeout: float) -> int:
+        """Block until the revision moves past ``revision`` or ``timeout`` passes."""
         with self.lock:
-            return json.loads(json.dumps(self.state))
+            self.changed.wait_for(lambda: self.revision != revision, timeout)
+            return self.revision
 
-    def reset_for_file(self, file_name: str, total_rows: int) -> None:
+    def reset_for_file(self, file_name: str, total_rows: int, mode: str = "full", pipeline: str = "bulk") -> None:
         with self.lock:
+            self._started = time.monotonic()
             self.state = self.DEFAULT_STATE.copy()
             self.state.update({
                 "running": True,
@@ -325,21 +1124,41 @@ class LoadingStateStore:
                 "error": None,
                 "latest_words": [],
                 "timestamp": datetime.utcnow().isoformat(),
+                "mode": mode,
+                "changes": None,
+                "pipeline": pipeline,
             })
             self._persist_locked(force=True)
 
+    def set_changes(self, inserted: int, updated: int, deleted: int) -> None:
+        with self.lock:
+            self.state["changes"] = {"inserted": inserted, "updated": updated, "deleted": deleted}
+            self.state["timestamp"] = datetime.utcnow().isoformat()
+            self._persist_locked()
+
     def set_current_sheet(self, sheet: Optional[str]) -> None:
         with self.lock:
             self.state["current_sheet"] = sheet
             self.state["timestamp"] = datetime.utcnow().isoformat()
             self._persist_locked()
 
+    def add_total(self, rows: int) -> None:
+        # sheets without dimension metadata are counted once they have been read
+        with self.lock:
+            processed = self.state.get("processed_words", 0)
+            total = max((self.state.get("total_words", 0) or 0) + int(rows), processed)
+            self.state["total_words"] = total
+            self.state["percent"] = (processed / total * 100.0) if total > 0 else 0.0
+            self.state["timestamp"] = datetime.utcnow().isoformat()
+            self._persist_locked()
+
     def increment_processed(self, increment: int = 1, sample_word: Optional[str] = None,
                              sample_step: int = 10, latest_limit: int = 40, force: bool = False) -> int:
         with self.lock:
             processed = self.state.get("processed_words", 0) + increment
             self.state["processed_words"] = processed
-            total = self.state.get("total_words", 0) or 0
+            total = max(self.state.get("total_words", 0) or 0, processed)
+            self.state["total_words"] = total
             self.state["percent"] = (processed / total * 100.0) if total > 0 else 0.0
             if sample_word and sample_word.strip():
                 if processed % sample_step == 0:
@@ -348,12 +1167,46 @@ class LoadingStateStore:
                     if len(latest) > latest_limit:
                         latest = latest[-latest_limit:]
                     self.state["latest_words"] = latest
+            self._update_throughput_locked()
             self.state["timestamp"] = datetime.utcnow().isoformat()
             self._persist_locked(force=force)
             return processed
 
+    def advance(self, count: int, sample_words: Iterable[str] = (),
+                sample_step: int = 10, latest_limit: int = 40) -> int:
+        """Account for a whole chunk of rows with one lock/timestamp/persist.
+
+        Samples every ``sample_step``-th row word, like ``increment_processed``.
+        """
+        with self.lock:
+            before = self.state.get("processed_words", 0)
+            processed = before + int(count)
+            self.state["processed_words"] = processed
+            total = max(self.state.get("total_words", 0) or 0, processed)
+            self.state["total_words"] = total
+            self.state["percent"] = (processed / total * 100.0) if total > 0 else 0.0
+            picked = [
+                w for n, w in enumerate(sample_words, start=before + 1)
+                if n % sample_step == 0 and w and w.strip()
+            ]
+            if picked:
+                latest = list(self.state.get("latest_words") or []) + picked
+                self.state["latest_words"] = latest[-latest_limit:]
+            self._update_throughput_locked()
+            self.state["timestamp"] = datetime.utcnow().isoformat()
+            self._persist_locked()
+            return processed
+
+    def _update_throughput_locked(self) -> None:
+        elapsed = time.monotonic() - self._started
+        self.state["elapsed_seconds"] = round(elapsed, 3)
+        processed = self.state.get("processed_words", 0) or 0
+        self.state["rows_per_second"] = round(processed / elapsed, 1) if elapsed > 0 else 0.0
+
     def mark_finished(self, error: Optional[str] = None) -> None:
         with self.lock:
+            if self.state.get("running"):
+                self._update_throughput_locked()
             self.state["running"] = False
             if error:
                 self.state["error"] = error
@@ -367,7 +1220,154 @@ class LoadingStateStore:
             self._persist_locked()
 
 
-loading_state = LoadingStateStore(STATE_FILE_PATH)
+loading_state = LoadingStateStore(STATE_FILE_PATH, persist=not IMPORT_WORKER_PROCESS)
+
+
+def _set_data_loaded(loaded: bool) -> None:
+    # progress streams report DATA_LOADED too, so wake them on every flip
+    app.config["DATA_LOADED"] = loaded
+    loading_state.mark_changed()
+
+
+class DictionaryConnectionPool:
+    """Read-only dictionary connections, opened once per worker thread.
+
+    Every thread keeps its own connection (``mode=ro``, ``query_only`` and mmap
+    enabled). ``invalidate`` bumps a generation counter; threads notice it on
+    their next checkout and reopen, so a rebuilt or replaced database file is
+    picked up without sharing connections across threads.
+    """
+
+    def __init__(self, path: str, mmap_size: int = SQLITE_MMAP_SIZE):
+        self.path = path
+        self.mmap_size = int(mmap_size)
+        self.lock = threading.Lock()
+        self._generation = 0
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        uri = f"{pathlib.Path(self.path).as_uri()}?mode=ro"
+        con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            con.execute("PRAGMA query_only=ON;")
+            con.execute(f"PRAGMA mmap_size={self.mmap_size};")
+        except Exception:
+            con.close()
+            raise
+        return con
+
+    def connection(self) -> sqlite3.Connection:
+        local = self._local
+        con = getattr(local, "con", None)
+        if con is not None and getattr(local, "generation", -1) == self._generation:
+            return con
+        self.discard()
+        con = self._open()
+        local.con = con
+        local.generation = self._generation
+        return con
+
+    def discard(self) -> None:
+        # drop the calling thread's connection, e.g. after a db error
+        con = getattr(self._local, "con", None)
+        self._local.con = None
+        if con is not None:
+            try:
+                con.close()
+            except Exception:
+                pass
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self._generation += 1
+
+
+dictionary_pool = DictionaryConnectionPool(SQLITE_DB_PATH)
+
+
+class DictionaryEntry(NamedTuple):
+    id: int
+    word: str
+    phonetic: str
+    meaning: str
+    sheet: str
+    row_index: int
+
+
+class DictionaryIndex:
+    """Immutable in-memory copy of the ``entries`` table.
+
+    Built once per database generation and published by swapping the
+    module-level ``dictionary_index`` reference, so readers never lock.
+    The first row per ``word_norm`` wins, matching ``LIMIT 1`` on the index.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[Any, ...]]):
+        by_norm: Dict[str, DictionaryEntry] = {}
+        by_row: Dict[Tuple[str, int], DictionaryEntry] = {}
+        intern = sys.intern
+        for row_id, norm, word, phonetic, meaning, sheet, row_index in rows:
+            entry = DictionaryEntry(
+                int(row_id),
+                word or "",
+                phonetic or "",
+                meaning or "",
+                intern(sheet or ""),
+                int(row_index) if row_index is not None else 0,
+            )
+            by_norm.setdefault(intern(norm or ""), entry)
+            by_row.setdefault((entry.sheet, entry.row_index), entry)
+        self.by_norm: Mapping[str, DictionaryEntry] = MappingProxyType(by_norm)
+        self.by_row: Mapping[Tuple[str, int], DictionaryEntry] = MappingProxyType(by_row)
+
+    def __len__(self) -> int:
+        return len(self.by_norm)
+
+    def lookup(self, norm: str) -> Optional[DictionaryEntry]:
+        return self.by_norm.get(norm)
+
+    def row(self, sheet: str, row_index: int) -> Optional[DictionaryEntry]:
+        return self.by_row.get((sheet, row_index))
+
+    @classmethod
+    def from_sqlite(cls, path: str) -> "DictionaryIndex":
+        con = sqlite3.connect(f"{pathlib.Path(path).as_uri()}?mode=ro", uri=True)
+        try:
+            cur = con.execute(
+                "SELECT id, word_norm, word, phonetic, meaning, sheet, row_index FROM entries ORDER BY id"
+            )
+            return cls(cur)
+        finally:
+            con.close()
+
+
+# Swapped atomically on publish; None means "ask SQLite"
+dictionary_index: Optional[DictionaryIndex] = None
+
+
+def _invalidate_dictionary_db() -> None:
+    # called whenever coca.sqlite is rebuilt, swapped or removed
+    global dictionary_index
+    dictionary_index = None
+    dictionary_pool.invalidate()
+
+
+def _publish_dictionary_db() -> None:
+    # called once a rebuilt coca.sqlite is committed and ready for readers
+    global dictionary_index
+    dictionary_pool.invalidate()
+    if not LOOKUP_IN_MEMORY:
+        dictionary_index = None
+        return
+    try:
+        dictionary_index = DictionaryIndex.from_sqlite(SQLITE_DB_PATH)
+    except Exception:
+        # lookups fall back to the connection pool
+        dictionary_index = None
 
 
 # -----------------------------
@@ -380,191 +1380,1311 @@ loading_thread: Optional[threading.Thread] = None
 loading_cancelled: bool = False
 
 
-def normalize_word(word: str) -> str:
-    if word is None:
-        return ""
-    # Keep letters, apostrophes, hyphens; lower-case
-    text = str(word).strip()
-    text = re.sub(r"[^A-Za-z\-']+", " ", text).strip().lower()
-    return text
+def normalize_word(word: str) -> str:
+    if word is None:
+        return ""
+    # Keep letters, apostrophes, hyphens; lower-case
+    text = str(word).strip()
+    text = re.sub(r"[^A-Za-z\-']+", " ", text).strip().lower()
+    return text
+
+
+def list_excel_files() -> List[Dict[str, Any]]:
+    files: List[Dict[str, Any]] = []
+    for name in os.listdir(BASE_DIR):
+        path = os.path.join(BASE_DIR, name)
+        if os.path.isfile(path):
+            _, ext = os.path.splitext(name)
+            if ext.lower() in EXCEL_EXTENSIONS:
+                stat = os.stat(path)
+                files.append({
+                    "name": name,
+                    "size": stat.st_size,
+                    "mtime": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                })
+    files.sort(key=lambda x: x["name"].lower())
+    return files
+
+ 
+
+
+class SheetInfo(NamedTuple):
+    title: str
+    rows: Optional[int]  # from the sheet's <dimension> element; None when absent
+    max_column: Optional[int]
+
+
+class WorkbookManifest(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    sheets: Tuple[SheetInfo, ...]
+
+    @property
+    def total_rows(self) -> int:
+        # rows of sheets without dimension metadata are added while importing
+        return sum(info.rows or 0 for info in self.sheets)
+
+
+_manifest_lock = threading.Lock()
+_manifest_cache: Dict[str, WorkbookManifest] = {}
+
+
+def workbook_manifest(file_path: str, wb=None) -> WorkbookManifest:
+    """Sheet names and row estimates, cached by (mtime, size).
+
+    Only the dimension metadata is read, never the rows. Pass an already
+    opened read-only workbook to avoid opening the file a second time.
+    """
+    st = os.stat(file_path)
+    with _manifest_lock:
+        cached = _manifest_cache.get(file_path)
+    if cached is not None and cached.mtime_ns == st.st_mtime_ns and cached.size == st.st_size:
+        return cached
+    own = wb is None
+    if own:
+        wb = open_workbook(file_path)
+    try:
+        sheets = tuple(SheetInfo(ws.title, ws.max_row, ws.max_column) for ws in wb.worksheets)
+    finally:
+        if own:
+            wb.close()
+    manifest = WorkbookManifest(file_path, st.st_mtime_ns, st.st_size, sheets)
+    with _manifest_lock:
+        _manifest_cache[file_path] = manifest
+    return manifest
+
+
+ENTRIES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  id INTEGER PRIMARY KEY,
+  word_norm TEXT NOT NULL,
+  word TEXT,
+  phonetic TEXT,
+  meaning TEXT,
+  sheet TEXT,
+  row_index INTEGER
+);
+"""
+
+class _IncrementalSync:
+    """Diff imported rows against an existing entries table by (sheet, row_index).
+
+    Only new or changed rows are written; rows that no longer appear in the
+    workbook are deleted in ``finish``.
+    """
+
+    def __init__(self, cur: sqlite3.Cursor):
+        self.cur = cur
+        self.existing: Dict[Tuple[str, int], Tuple[Any, ...]] = {}
+        for row_id, norm, word, phonetic, meaning, sheet, row_index in cur.execute(
+            "SELECT id, word_norm, word, phonetic, meaning, sheet, row_index FROM entries ORDER BY id"
+        ):
+            self.existing.setdefault((sheet, row_index), (row_id, norm, word, phonetic, meaning))
+        self.seen: set = set()
+        self.inserted = 0
+        self.updated = 0
+
+    def apply(self, batch: List[EntryRow]) -> None:
+        inserts: List[EntryRow] = []
+        updates: List[Tuple[Any, ...]] = []
+        for row in batch:
+            norm, word, phonetic, meaning, sheet, row_index = row
+            key = (sheet, row_index)
+            self.seen.add(key)
+            old = self.existing.get(key)
+            if old is None:
+                inserts.append(row)
+            elif old[1:] != (norm, word, phonetic, meaning):
+                updates.append((norm, word, phonetic, meaning, old[0]))
+        if inserts:
+            self.cur.executemany(
+                "INSERT INTO entries (word_norm, word, phonetic, meaning, sheet, row_index) VALUES (?, ?, ?, ?, ?, ?)",
+                inserts,
+            )
+        if updates:
+            self.cur.executemany(
+                "UPDATE entries SET word_norm = ?, word = ?, phonetic = ?, meaning = ? WHERE id = ?",
+                updates,
+            )
+        self.inserted += len(inserts)
+        self.updated += len(updates)
+
+    def finish(self) -> Tuple[int, int, int]:
+        stale = [(v[0],) for k, v in self.existing.items() if k not in self.seen]
+        if stale:
+            self.cur.executemany("DELETE FROM entries WHERE id = ?", stale)
+        return self.inserted, self.updated, len(stale)
+
+
+def _remove_db_files(path: str) -> None:
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _prepare_shadow_db() -> None:
+    """Start the shadow database as a copy of the live one (when there is one)."""
+    _remove_db_files(SHADOW_DB_PATH)
+    if not os.path.exists(SQLITE_DB_PATH):
+        return
+    src = sqlite3.connect(f"{pathlib.Path(SQLITE_DB_PATH).as_uri()}?mode=ro", uri=True)
+    dst = sqlite3.connect(SHADOW_DB_PATH)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _swap_shadow_db() -> None:
+    # the shadow file is switched to rollback-journal mode so it is self-contained,
+    # then renamed over the live db; readers holding the old file keep their inode
+    con = sqlite3.connect(SHADOW_DB_PATH)
+    try:
+        con.execute("PRAGMA journal_mode=DELETE;")
+    finally:
+        con.close()
+    os.replace(SHADOW_DB_PATH, SQLITE_DB_PATH)
+    for suffix in ("-wal", "-shm"):
+        try:
+            os.remove(SQLITE_DB_PATH + suffix)
+        except FileNotFoundError:
+            pass
+
+
+# Sampling config for preview
+SAMPLE_STEP = 10
+LATEST_LIMIT = 40
+
+
+def _iter_sheet_rows(ws, sheet: str) -> Iterator[List[EntryRow]]:
+    """Legacy pipeline: normalize and report progress row by row."""
+    word_col_idx = word_column(ws)
+    # iterate and batch insert
+    batch: List[EntryRow] = []
+    for row_idx, row in enumerate(ws.iter_rows(values_only=True)):
+        if loading_cancelled:
+            raise RuntimeError("loading cancelled")
+        # guard for row tuple shorter than expected
+        word_raw = row[word_col_idx] if word_col_idx < len(row or ()) else None
+        display_word = "" if word_raw is None else str(word_raw).strip()
+        norm = normalize_word(display_word)
+        # map optional columns 2 and 3 when present
+        phonetic_val = row[2] if (row and len(row) > 2) else None
+        meaning_val = row[3] if (row and len(row) > 3) else None
+        phonetic = None if phonetic_val is None else str(phonetic_val)
+        meaning = None if meaning_val is None else str(meaning_val)
+
+        batch.append((norm, display_word or None, phonetic, meaning, sheet, int(row_idx)))
+
+        loading_state.increment_processed(
+            increment=1,
+            sample_word=display_word,
+            sample_step=SAMPLE_STEP,
+            latest_limit=LATEST_LIMIT,
+        )
+
+        # flush in batches
+        if len(batch) >= 10000:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _iter_sheet_chunks(ws, sheet: str, chunk_rows: int = IMPORT_CHUNK_ROWS) -> Iterator[List[EntryRow]]:
+    """Bulk pipeline: normalize a chunk of rows at once, one progress update per chunk."""
+    word_col_idx = word_column(ws)
+    rows_iter = ws.iter_rows(values_only=True)
+    offset = 0
+    while True:
+        if loading_cancelled:
+            raise RuntimeError("loading cancelled")
+        chunk = list(itertools.islice(rows_iter, chunk_rows))
+        if not chunk:
+            break
+        batch, display_list = rows_to_entries(chunk, word_col_idx, sheet, offset)
+        offset += len(chunk)
+        loading_state.advance(len(chunk), display_list, sample_step=SAMPLE_STEP, latest_limit=LATEST_LIMIT)
+        yield batch
+
+
+def _import_pool(workers: int) -> ProcessPoolExecutor:
+    # never fork the multithreaded server; workers only need excel_worker, and when this file
+    # is the __main__ script its re-import in them skips startup via IMPORT_WORKER_PROCESS
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _iter_parallel_batches(wb, file_path: str, manifest: WorkbookManifest) -> Iterator[List[EntryRow]]:
+    """Parallel pipeline: each sheet is parsed in its own worker process and
+    batches are yielded in workbook order to the single writer. A workbook
+    with one sheet has nothing to parallelize and goes through the bulk pipeline.
+    """
+    workers = min(IMPORT_WORKERS, len(manifest.sheets))
+    if workers < 2:
+        yield from _iter_sequential_batches(wb, manifest, "bulk")
+        return
+    pool = _import_pool(workers)
+    try:
+        futures = [pool.submit(parse_sheet, file_path, info.title) for info in manifest.sheets]
+        for info, future in zip(manifest.sheets, futures):
+            if loading_cancelled:
+                raise RuntimeError("loading cancelled")
+            entries, display_list = future.result()
+            loading_state.set_current_sheet(info.title)
+            if info.rows is None:
+                loading_state.add_total(len(entries))
+            for start in range(0, len(entries), IMPORT_CHUNK_ROWS):
+                batch = entries[start:start + IMPORT_CHUNK_ROWS]
+                loading_state.advance(len(batch), display_list[start:start + IMPORT_CHUNK_ROWS],
+                                      sample_step=SAMPLE_STEP, latest_limit=LATEST_LIMIT)
+                yield batch
+    finally:
+        # pending sheets are dropped on cancel/error; running ones finish in the background
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_sequential_batches(wb, manifest: WorkbookManifest, pipeline: str) -> Iterator[List[EntryRow]]:
+    read_sheet = _iter_sheet_chunks if pipeline == "bulk" else _iter_sheet_rows
+    for info in manifest.sheets:
+        loading_state.set_current_sheet(info.title)
+        rows = 0
+        for batch in read_sheet(wb[info.title], info.title):
+            rows += len(batch)
+            yield batch
+        if info.rows is None:
+            loading_state.add_total(rows)
+
+
+def _rebuild_sqlite_from_excel(file_path: str, incremental: bool = False, pipeline: str = "bulk",
+                               wb=None, manifest: Optional[WorkbookManifest] = None) -> None:
+    """Rebuild a single SQLite database from the given Excel file.
+    - Full mode: querying is disabled during rebuild (handled by caller via flags)
+    - Incremental mode: rows are diffed into a shadow copy which is swapped in
+      atomically at the end, so the live database keeps serving lookups
+    - ``pipeline="bulk"`` reads and normalizes rows in chunks with one progress
+      update per chunk; ``"legacy"`` keeps the per-row loop for comparison;
+      ``"parallel"`` parses whole sheets in a process pool feeding this single writer
+    - After successful rebuild, mark DATA_LOADED=True
+    Table schema columns: word_norm, word, phonetic, meaning, sheet, row_index
+    """
+    # Prepare excel reader (streaming); the caller usually hands in the workbook it
+    # already opened for the manifest so the file is parsed only once
+    if wb is None:
+        wb = open_workbook(file_path)
+    if manifest is None:
+        manifest = workbook_manifest(file_path, wb)
+
+    # Create directory for DB if missing
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    # Create SQLite and write in one transaction
+    if incremental:
+        _prepare_shadow_db()
+        db_path = SHADOW_DB_PATH
+    else:
+        _invalidate_dictionary_db()
+        db_path = SQLITE_DB_PATH
+    con = sqlite3.connect(db_path)
+    cur = con.cursor()
+    try:
+        # Pragmas for faster build
+        if not incremental:
+            cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute("PRAGMA synchronous=NORMAL;")
+        cur.execute("PRAGMA temp_store=MEMORY;")
+
+        if not incremental:
+            cur.execute("DROP TABLE IF EXISTS entries;")
+        cur.execute(ENTRIES_SCHEMA)
+        sync = _IncrementalSync(cur) if incremental else None
+
+        con.execute("BEGIN;")
+
+        loading_state.clear_error()
+
+        insert_sql = (
+            "INSERT INTO entries (word_norm, word, phonetic, meaning, sheet, row_index) VALUES (?, ?, ?, ?, ?, ?)"
+        )
+
+        def flush(rows: List[EntryRow]) -> None:
+            if sync is not None:
+                sync.apply(rows)
+            else:
+                cur.executemany(insert_sql, rows)
+
+        # We reuse total_words computed by caller; processed_words is reset in caller
+        if pipeline == "parallel":
+            batches = _iter_parallel_batches(wb, file_path, manifest)
+        else:
+            batches = _iter_sequential_batches(wb, manifest, pipeline)
+        for batch in batches:
+            flush(batch)
+
+        if sync is not None:
+            loading_state.set_changes(*sync.finish())
+
+        # index after all inserts
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_word_norm ON entries(word_norm);")
+        # speed up row lookup by (sheet,row_index)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_sheet_row ON entries(sheet, row_index);")
+
+        con.commit()
+    except BaseException:
+        # closing without commit rolls back the partial import
+        con.close()
+        if incremental:
+            _remove_db_files(SHADOW_DB_PATH)
+        raise
+    con.close()
+
+    if incremental:
+        _swap_shadow_db()
+    _publish_dictionary_db()
+
+    # mark loaded
+    _set_data_loaded(True)
+    global current_excel_file
+    current_excel_file = file_path
+
+ 
+
+
+def _loader_worker(file_path: str, incremental: bool = False, pipeline: str = "bulk"):
+    global loading_thread, loading_cancelled
+    wb = None
+    try:
+        file_name = os.path.basename(file_path)
+        # single pass: the workbook opened here feeds both the row estimate and the import
+        wb = open_workbook(file_path)
+        manifest = workbook_manifest(file_path, wb)
+        loading_state.reset_for_file(
+            file_name, manifest.total_rows, mode="incremental" if incremental else "full", pipeline=pipeline,
+        )
+        loading_cancelled = False
+        _rebuild_sqlite_from_excel(file_path, incremental=incremental, pipeline=pipeline, wb=wb, manifest=manifest)
+    except Exception as exc:
+        loading_state.mark_finished(error=str(exc))
+    finally:
+        if wb is not None:
+            wb.close()
+        loading_state.mark_finished()
+        loading_thread = None
+
+
+def list_txt_files() -> List[str]:
+    files: List[str] = []
+    if not os.path.isdir(DATA_DIR):
+        return files
+    for name in os.listdir(DATA_DIR):
+        path = os.path.join(DATA_DIR, name)
+        if os.path.isfile(path):
+            _, ext = os.path.splitext(name)
+            if ext.lower() in TXT_EXTENSIONS:
+                files.append(name)
+    # Sort by natural order when possible
+    files.sort(key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", s)])
+    return files
+
+
+# Marked tokens in sentence files, same pattern as parseMarkedTokens in text.js
+MARKED_TOKEN_RE = re.compile(r"\[\[([A-Za-z][A-Za-z\-']{0,63})\]\]")
+SENTENCE_RESCAN_INTERVAL = 5.0  # seconds between mtime checks of data_sentence
+VOCAB_RECHECK_INTERVAL = 30.0  # seconds between signature checks of the rank lists
+BATCH_LOOKUP_LIMIT = 1000
+SQLITE_IN_CHUNK = 500  # stay below SQLITE_MAX_VARIABLE_NUMBER on old builds
+
+
+def safe_txt_name(name: str) -> str:
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("missing name")
+    # Security: only allow files from base dir and with .txt
+    safe_name = os.path.basename(name)
+    _, ext = os.path.splitext(safe_name)
+    if ext.lower() not in TXT_EXTENSIONS:
+        raise ValueError("invalid file type")
+    return safe_name
+
+
+def txt_base_dir() -> str:
+    return DATA_DIR if os.path.isdir(DATA_DIR) else BASE_DIR
+
+
+def read_txt_file(file_path: str) -> str:
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(file_path, "r", encoding="gb18030", errors="ignore") as f:
+            return f.read()
+
+
+def tokenize_sentence(text: str) -> List[Dict[str, Any]]:
+    """Split sentence text into the segments text.js renders.
+
+    ``token`` segments are ``[[word]]`` markers and ``text`` segments are
+    everything in between; plain words stay inside ``text`` so the payload
+    is barely larger than the file (the client makes them clickable).
+    """
+    segments: List[Dict[str, Any]] = []
+    text = text or ""
+    last = 0
+    for m in MARKED_TOKEN_RE.finditer(text):
+        if m.start() > last:
+            segments.append({"type": "text", "value": text[last:m.start()]})
+        word = m.group(1).strip()
+        segments.append({"type": "token", "word": word, "norm": normalize_word(word)})
+        last = m.end()
+    if last < len(text):
+        segments.append({"type": "text", "value": text[last:]})
+    return segments
+
+
+def lookup_many(norms: Iterable[str]) -> Dict[str, DictionaryEntry]:
+    """Resolve many normalized words at once: memory index or chunked ``IN`` queries."""
+    wanted = list(dict.fromkeys(n for n in norms if n))
+    found: Dict[str, DictionaryEntry] = {}
+    index = dictionary_index
+    if index is not None:
+        for norm in wanted:
+            entry = index.lookup(norm)
+            if entry is not None:
+                found[norm] = entry
+        return found
+    con = dictionary_pool.connection()
+    for start in range(0, len(wanted), SQLITE_IN_CHUNK):
+        chunk = wanted[start:start + SQLITE_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        cur = con.execute(
+            "SELECT id, word_norm, word, phonetic, meaning, sheet, row_index FROM entries "
+            f"WHERE word_norm IN ({placeholders}) ORDER BY id",
+            chunk,
+        )
+        for row_id, norm, word, phonetic, meaning, sheet, row_index in cur:
+            if norm not in found:
+                found[norm] = DictionaryEntry(
+                    int(row_id), word or "", phonetic or "", meaning or "",
+                    sheet or "", int(row_index) if row_index is not None else 0,
+                )
+    return found
+
+
+def _batch_lookup_payload(words: Iterable[str]) -> Dict[str, Any]:
+    norms = [normalize_word(w) for w in words]
+    found = lookup_many(norms)
+    results = {
+        norm: {"1": e.word, "2": e.phonetic, "3": e.meaning}
+        for norm, e in found.items()
+    }
+    missing = [n for n in dict.fromkeys(norms) if n and n not in found]
+    return {"count": len(results), "results": results, "missing": missing}
+
+
+class EncodedBody:
+    """A response body with precomputed gzip/brotli variants and strong ETags."""
+
+    MIN_COMPRESS_SIZE = 256
+
+    def __init__(self, raw: bytes, mimetype: str = "application/json"):
+        self.raw = raw
+        self.mimetype = mimetype
+        self.digest = hashlib.sha1(raw).hexdigest()
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        if len(raw) >= self.MIN_COMPRESS_SIZE:
+            packed = gzip.compress(raw, compresslevel=9, mtime=0)
+            if len(packed) < len(raw):
+                self.gzip = packed
+            if brotli is not None:
+                packed = brotli.compress(raw)
+                if len(packed) < len(raw):
+                    self.br = packed
+
+    @classmethod
+    def from_json(cls, obj: Any) -> "EncodedBody":
+        return cls(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    def etags(self) -> List[str]:
+        return [self.digest, f"{self.digest}-gz", f"{self.digest}-br"]
+
+
+def encoded_response(body: EncodedBody, cache_control: str = "no-cache") -> Response:
+    """Serve ``body`` honouring If-None-Match and Accept-Encoding."""
+    matched = next((tag for tag in body.etags() if request.if_none_match.contains(tag)), None)
+    if matched is not None:
+        resp = Response(status=304)
+        resp.set_etag(matched)
+    else:
+        accept = request.accept_encodings
+        if body.br is not None and accept["br"]:
+            data, encoding, tag = body.br, "br", f"{body.digest}-br"
+        elif body.gzip is not None and accept["gzip"]:
+            data, encoding, tag = body.gzip, "gzip", f"{body.digest}-gz"
+        else:
+            data, encoding, tag = body.raw, None, body.digest
+        resp = Response(data, mimetype=body.mimetype)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(tag)
+    resp.headers["Cache-Control"] = cache_control
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+class SentenceFile:
+    __slots__ = ("name", "mtime_ns", "size", "text", "content", "segments", "_tokens")
+
+    def __init__(self, name: str, path: str, stat: os.stat_result):
+        self.name = name
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.text = read_txt_file(path)
+        # body of /api/txt/content
+        self.content = EncodedBody.from_json({"name": name, "content": self.text})
+        self.segments = tokenize_sentence(self.text.strip())
+        self._tokens: Tuple[int, Optional[EncodedBody]] = (-1, None)
+
+    def token_norms(self) -> List[str]:
+        return [seg["norm"] for seg in self.segments if seg["type"] == "token"]
+
+    def tokens_body(self) -> EncodedBody:
+        """Body of ``format=tokens``; dictionary ids are joined once per db generation.
+
+        ``id`` is the dictionary row id, or null for a word the dictionary
+        lacks. While no dictionary is loaded (or the join fails) tokens carry
+        no ``id`` at all and the body is not cached, so a request racing a
+        rebuild never pins unresolved ids to the new generation.
+        """
+        generation = dictionary_pool.generation
+        cached_generation, body = self._tokens
+        if body is not None and cached_generation == generation:
+            return body
+        found: Optional[Dict[str, DictionaryEntry]] = None
+        if app.config.get("DATA_LOADED", False):
+            try:
+                found = lookup_many(self.token_norms())
+            except Exception:
+                dictionary_pool.discard()
+        segments = []
+        for seg in self.segments:
+            if seg["type"] == "token":
+                seg = dict(seg)
+                if found is not None:
+                    entry = found.get(seg["norm"])
+                    seg["id"] = entry.id if entry is not None else None
+                if seg["norm"] == seg["word"]:
+                    del seg["norm"]  # the common case; clients fall back to word
+            segments.append(seg)
+        body = EncodedBody.from_json({
+            "name": self.name,
+            "format": "tokens",
+            "count": sum(1 for seg in segments if seg["type"] == "token"),
+            "segments": segments,
+        })
+        if found is not None:
+            self._tokens = (generation, body)
+        return body
+
+
+class SentenceFileCache:
+    """Decoded sentence files with pre-encoded response bodies.
+
+    Files are read once and re-read only when their mtime or size changes;
+    a background thread re-stats the directory every ``interval`` seconds so
+    request handlers never touch the disk.
+    """
+
+    def __init__(self, interval: float = SENTENCE_RESCAN_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.files: Dict[str, SentenceFile] = {}
+        self._loaded = False
+        self._watcher: Optional[threading.Thread] = None
+
+    def refresh(self) -> None:
+        with self.lock:
+            base = txt_base_dir()
+            current: Dict[str, SentenceFile] = {}
+            try:
+                names = os.listdir(base)
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                if os.path.splitext(name)[1].lower() not in TXT_EXTENSIONS:
+                    continue
+                path = os.path.join(base, name)
+                try:
+                    st = os.stat(path)
+                    if not os.path.isfile(path):
+                        continue
+                    old = self.files.get(name)
+                    if old is not None and old.mtime_ns == st.st_mtime_ns and old.size == st.st_size:
+                        current[name] = old
+                    else:
+                        current[name] = SentenceFile(name, path, st)
+                except OSError:
+                    continue
+            # publish by reference swap; readers keep whatever dict they grabbed
+            self.files = current
+            self._loaded = True
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception:
+                app.logger.exception("Sentence file rescan failed")
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self.refresh()
+        with self.lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="sentence-cache", daemon=True)
+                self._watcher.start()
+
+    def get(self, name: str) -> Optional[SentenceFile]:
+        self._ensure_loaded()
+        return self.files.get(name)
+
+
+sentence_cache = SentenceFileCache()
+
+
+# -----------------------------
+# COCA rank index (data_vocabulary/partNNN_a-b.txt)
+# -----------------------------
+VOCAB_FILE_RE = re.compile(r"^part(\d+)_(\d+)-(\d+)\.txt$", re.IGNORECASE)
+SENTENCE_RANGE_RE = re.compile(r"^(\d+)-(\d+)\.txt$", re.IGNORECASE)
+
+
+class VocabEntry(NamedTuple):
+    rank: int
+    word: str
+    sentence_file: Optional[str]
+
+
+def _vocab_files() -> List[Tuple[int, str]]:
+    # (first rank, file name), ordered by rank
+    files: List[Tuple[int, str]] = []
+    try:
+        names = os.listdir(VOCAB_DIR)
+    except FileNotFoundError:
+        return files
+    for name in names:
+        m = VOCAB_FILE_RE.match(name)
+        if m:
+            files.append((int(m.group(2)), name))
+    files.sort()
+    return files
+
+
+def _sentence_ranges() -> List[Tuple[int, int, str]]:
+    ranges: List[Tuple[int, int, str]] = []
+    for name in list_txt_files():
+        m = SENTENCE_RANGE_RE.match(name)
+        if m:
+            ranges.append((int(m.group(1)), int(m.group(2)), name))
+    ranges.sort()
+    return ranges
+
+
+def _sentence_file_for_rank(ranges: List[Tuple[int, int, str]], rank: int) -> Optional[str]:
+    pos = bisect.bisect_right(ranges, (rank, float("inf"), "")) - 1
+    if pos >= 0 and ranges[pos][0] <= rank <= ranges[pos][1]:
+        return ranges[pos][2]
+    return None
+
+
+def _iter_vocab_rows(files: List[Tuple[int, str]],
+                     ranges: List[Tuple[int, int, str]]) -> Iterator[Tuple[int, str, str, str, Optional[str]]]:
+    """Stream (rank, word, word_norm, part_file, sentence_file) line by line."""
+    for first_rank, name in files:
+        rank = first_rank
+        with open(os.path.join(VOCAB_DIR, name), "r", encoding="utf-8", errors="ignore") as fh:
+            for line in fh:
+                word = line.strip()
+                if not word:
+                    continue
+                yield rank, word, normalize_word(word), name, _sentence_file_for_rank(ranges, rank)
+                rank += 1
+
+
+class VocabularyIndex:
+    """COCA frequency ranks in memory: word -> rank/sentence file and rank -> word.
+
+    The first (most frequent) rank wins for words listed more than once.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[Any, ...]], signature: str = ""):
+        self.signature = signature  # _vocab_signature of the files it was built from
+        by_norm: Dict[str, VocabEntry] = {}
+        by_rank: Dict[int, VocabEntry] = {}
+        intern = sys.intern
+        for rank, word, norm, sentence_file in rows:
+            entry = VocabEntry(int(rank), word, intern(sentence_file) if sentence_file else None)
+            by_rank[entry.rank] = entry
+            by_norm.setdefault(intern(norm), entry)
+        self.by_norm: Mapping[str, VocabEntry] = MappingProxyType(by_norm)
+        self.by_rank: Mapping[int, VocabEntry] = MappingProxyType(by_rank)
+
+    def __len__(self) -> int:
+        return len(self.by_rank)
+
+    def lookup(self, norm: str) -> Optional[VocabEntry]:
+        return self.by_norm.get(norm)
+
+    def rank(self, rank: int) -> Optional[VocabEntry]:
+        return self.by_rank.get(rank)
+
+
+def _vocab_signature(files: List[Tuple[int, str]], ranges: List[Tuple[int, int, str]]) -> str:
+    digest = hashlib.sha1()
+    for _, name in files:
+        st = os.stat(os.path.join(VOCAB_DIR, name))
+        digest.update(f"{name}:{st.st_mtime_ns}:{st.st_size};".encode("utf-8"))
+    for start, stop, name in ranges:
+        digest.update(f"{start}-{stop}:{name};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def ingest_vocabulary(force: bool = False) -> VocabularyIndex:
+    """Stream the rank lists into ``vocab.sqlite`` and return the in-memory index.
+
+    The table is rebuilt only when the word lists or sentence files changed.
+    """
+    files = _vocab_files()
+    ranges = _sentence_ranges()
+    signature = _vocab_signature(files, ranges)
+    os.makedirs(os.path.dirname(VOCAB_SQLITE_PATH), exist_ok=True)
+    con = sqlite3.connect(VOCAB_SQLITE_PATH)
+    try:
+        cur = con.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vocab (
+              rank INTEGER PRIMARY KEY,
+              word TEXT NOT NULL,
+              word_norm TEXT NOT NULL,
+              part_file TEXT,
+              sentence_file TEXT
+            );
+            """
+        )
+        cur.execute("CREATE TABLE IF NOT EXISTS vocab_meta (key TEXT PRIMARY KEY, value TEXT);")
+        row = cur.execute("SELECT value FROM vocab_meta WHERE key='signature'").fetchone()
+        if force or not row or row[0] != signature:
+            cur.execute("DELETE FROM vocab")
+            rows = _iter_vocab_rows(files, ranges)
+            while True:
+                batch = list(itertools.islice(rows, IMPORT_CHUNK_ROWS))
+                if not batch:
+                    break
+                cur.executemany(
+                    "INSERT OR IGNORE INTO vocab (rank, word, word_norm, part_file, sentence_file) VALUES (?, ?, ?, ?, ?)",
+                    batch,
+                )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_vocab_word_norm ON vocab(word_norm);")
+            cur.execute("INSERT OR REPLACE INTO vocab_meta(key, value) VALUES('signature', ?)", (signature,))
+            con.commit()
+        cur.execute("SELECT rank, word, word_norm, sentence_file FROM vocab ORDER BY rank")
+        return VocabularyIndex(cur, signature)
+    finally:
+        con.close()
+
+
+_vocab_lock = threading.Lock()
+vocabulary_index: Optional[VocabularyIndex] = None
+_vocab_checked = 0.0  # monotonic time of the last signature check
+
+
+def get_vocabulary_index() -> VocabularyIndex:
+    """Current rank index; re-ingested when the word lists or sentence files change.
+
+    The signature is re-checked at most every ``VOCAB_RECHECK_INTERVAL``
+    seconds. While one request rebuilds, the others keep the old index.
+    """
+    global vocabulary_index, _vocab_checked
+    index = vocabulary_index
+    if index is not None and time.monotonic() - _vocab_checked < VOCAB_RECHECK_INTERVAL:
+        return index
+    if index is not None and not _vocab_lock.acquire(blocking=False):
+        return index
+    if index is None:
+        _vocab_lock.acquire()
+    try:
+        if vocabulary_index is None or time.monotonic() - _vocab_checked >= VOCAB_RECHECK_INTERVAL:
+            if vocabulary_index is None or _vocab_signature(_vocab_files(), _sentence_ranges()) != vocabulary_index.signature:
+                vocabulary_index = ingest_vocabulary()
+            _vocab_checked = time.monotonic()
+        return vocabulary_index
+    finally:
+        _vocab_lock.release()
+
+
+def _vocab_payload(entry: VocabEntry) -> Dict[str, Any]:
+    # join the rank entry with the dictionary row when a dictionary is loaded
+    payload: Dict[str, Any] = {
+        "rank": entry.rank,
+        "word": entry.word,
+        "sentence_file": entry.sentence_file,
+        "row": None,
+    }
+    if app.config.get("DATA_LOADED", False):
+        try:
+            found = lookup_many([normalize_word(entry.word)])
+        except Exception:
+            dictionary_pool.discard()
+            found = {}
+        hit = next(iter(found.values()), None)
+        if hit is not None:
+            payload["row"] = {"1": hit.word, "2": hit.phonetic, "3": hit.meaning}
+    return payload
+
+
+# -----------------------------
+# AI upstream
+# -----------------------------
+_upstream_timing = threading.local()  # connect seconds spent by the current thread's request
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        # TCP (+ TLS) setup; stays 0 when the pool hands out a kept-alive connection
+        _upstream_timing.connect = getattr(_upstream_timing, "connect", 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class UpstreamClient:
+    """Shared keep-alive client for the chat-completions upstream.
+
+    One requests.Session with a pooled adapter is used from every worker
+    thread, so TCP/TLS setup is paid once per pooled connection rather than
+    once per AI message. Each call reports connect time (0 on a reused
+    connection) and time to first byte.
+    """
+
+    def __init__(self, base_url: str = AI_API_BASE_URL, pool_size: int = AI_POOL_SIZE,
+                 connect_timeout: float = AI_CONNECT_TIMEOUT, read_timeout: float = AI_READ_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = _TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, path: str, payload: Dict[str, Any], headers: Dict[str, str],
+             stream: bool = False) -> Tuple[requests.Response, Dict[str, float]]:
+        _upstream_timing.connect = 0.0
+        started = time.perf_counter()
+        r = self.session.post(f"{self.base_url}{path}", json=payload, headers=headers,
+                              timeout=self.timeout, stream=stream)
+        connect = _upstream_timing.connect
+        timing = {
+            "connect_ms": round(connect * 1000, 1),
+            # r.elapsed runs from sending until the headers are parsed and includes
+            # a new connection's setup, so TTFB starts once the connection exists
+            "ttfb_ms": round(max(0.0, r.elapsed.total_seconds() - connect) * 1000, 1),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        return r, timing
+
+    def close(self) -> None:
+        self.session.close()
+
+
+ai_client = UpstreamClient()
+
+
+class AIResponseCache:
+    """Persistent cache of AI replies keyed on sha256(model, system, content, api key).
 
+    Identical prompts from different learners share one entry. Hits never
+    reach the upstream, so they are only served to callers whose api key
+    (by sha256) has had a successful upstream call within ``ttl``; other
+    callers go upstream and verify their key that way. Entries expire after ``ttl`` seconds, and the
+    least recently used ones are evicted once the stored replies exceed
+    ``max_bytes``; hit access times are written in batches every
+    ``touch_interval`` seconds. Concurrent identical requests are coalesced:
+    the first caller becomes the leader and asks the upstream, the others
+    wait for its result.
+    """
 
-def list_excel_files() -> List[Dict[str, Any]]:
-    files: List[Dict[str, Any]] = []
-    for name in os.listdir(BASE_DIR):
-        path = os.path.join(BASE_DIR, name)
-        if os.path.isfile(path):
-            _, ext = os.path.splitext(name)
-            if ext.lower() in EXCEL_EXTENSIONS:
-                stat = os.stat(path)
-                files.append({
-                    "name": name,
-                    "size": stat.st_size,
-                    "mtime": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
-                })
-    files.sort(key=lambda x: x["name"].lower())
-    return files
+    def __init__(self, path: str = AI_CACHE_PATH, ttl: float = AI_CACHE_TTL,
+                 max_bytes: int = AI_CACHE_MAX_BYTES, wait_timeout: float = AI_READ_TIMEOUT,
+                 touch_interval: float = AI_CACHE_TOUCH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        self.con: Optional[sqlite3.Connection] = None
+        self.total_bytes = 0
+        self.touched: Dict[str, float] = {}  # key -> access time not yet written
+        self.touched_at = time.monotonic()
+        self.verified: Dict[str, float] = {}  # credential hash -> last successful upstream call
+        self.inflight: Dict[str, threading.Event] = {}
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def key(model: str, system: str, content: str) -> str:
+        raw = json.dumps([model, system, content], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def credential(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        # caller holds self.lock
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            con = sqlite3.connect(self.path, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "key TEXT PRIMARY KEY, model TEXT, message TEXT NOT NULL, usage TEXT, "
+                "created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_accessed ON ai_cache(accessed)")
+            con.execute("CREATE TABLE IF NOT EXISTS ai_credentials (hash TEXT PRIMARY KEY, verified REAL NOT NULL)")
+            con.commit()
+            self.total_bytes = int(con.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0])
+            self.con = con
+        return self.con
 
- 
+    def is_verified(self, credential: str) -> bool:
+        now = time.time()
+        with self.lock:
+            verified = self.verified.get(credential)
+            if verified is None:
+                # only verified hashes are remembered, so unknown keys cannot grow the dict
+                row = self._db().execute("SELECT verified FROM ai_credentials WHERE hash=?", (credential,)).fetchone()
+                if row is None:
+                    return False
+                verified = self.verified[credential] = row[0]
+            return verified + self.ttl >= now
+
+    def verify(self, credential: str) -> None:
+        """Record a successful upstream call made with this credential."""
+        now = time.time()
+        with self.lock:
+            if self.verified.get(credential, 0.0) + self.touch_interval > now:
+                return
+            self.verified[credential] = now
+            con = self._db()
+            con.execute("INSERT OR REPLACE INTO ai_credentials(hash, verified) VALUES(?, ?)", (credential, now))
+            con.commit()
 
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            con = self._db()
+            row = con.execute("SELECT message, usage, created, size FROM ai_cache WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            message, usage, created, size = row
+            if created + self.ttl < now:
+                con.execute("DELETE FROM ai_cache WHERE key=?", (key,))
+                con.commit()
+                self.touched.pop(key, None)
+                self.total_bytes -= size
+                self.counters["expired"] += 1
+                return None
+            self.touched[key] = now
+            if time.monotonic() - self.touched_at >= self.touch_interval:
+                self._write_touched_locked(con)
+                con.commit()
+            self.counters["hits"] += 1
+        return {"message": message, "usage": json.loads(usage) if usage else None}
+
+    def put(self, key: str, model: str, message: str, usage: Any = None) -> None:
+        now = time.time()
+        usage_json = json.dumps(usage, ensure_ascii=False) if usage is not None else None
+        size = len(message.encode("utf-8")) + len(usage_json or "")
+        with self.lock:
+            con = self._db()
+            old = con.execute("SELECT size FROM ai_cache WHERE key=?", (key,)).fetchone()
+            con.execute(
+                "INSERT OR REPLACE INTO ai_cache(key, model, message, usage, created, accessed, size) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (key, model, message, usage_json, now, now, size),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.counters["stores"] += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict_locked(con, now)
+            con.commit()
 
-def compute_total_rows(file_path: str) -> int:
-    try:
-        from openpyxl import load_workbook
-        wb = load_workbook(filename=file_path, read_only=True, data_only=True)
-        total = 0
-        for ws in wb.worksheets:
-            total += (ws.max_row or 0)
-        return total
-    except Exception:
-        # Fallback: estimate by parsing sheets with pandas (slower)
-        try:
-            xls = pd.ExcelFile(file_path)
-            total = 0
-            for sheet in xls.sheet_names:
-                df = xls.parse(sheet_name=sheet, header=None, dtype=str)
-                total += df.shape[0]
-            return total
-        except Exception:
-            return 0
+    def _write_touched_locked(self, con: sqlite3.Connection) -> None:
+        # caller commits
+        if self.touched:
+            con.executemany("UPDATE ai_cache SET accessed=? WHERE key=?",
+                            [(ts, key) for key, ts in self.touched.items()])
+            self.touched = {}
+        self.touched_at = time.monotonic()
+
+    def _evict_locked(self, con: sqlite3.Connection, now: float) -> None:
+        self._write_touched_locked(con)  # LRU order needs the pending access times
+        cur = con.execute("DELETE FROM ai_cache WHERE created < ?", (now - self.ttl,))
+        self.counters["expired"] += cur.rowcount
+        self.total_bytes = int(con.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0])
+        # oldest accessed first, until the store is back under its budget
+        for key, size in con.execute("SELECT key, size FROM ai_cache ORDER BY accessed").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            con.execute("DELETE FROM ai_cache WHERE key=?", (key,))
+            self.total_bytes -= size
+            self.counters["evictions"] += 1
+
+    def acquire(self, key: str,
+                before_wait: Optional[Callable[[], None]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Single-flight lookup: returns (cached reply, is_leader).
+
+        A leader must call ``release`` once its upstream call has finished,
+        successfully or not. A caller that got neither a reply nor
+        leadership (the leader timed out) goes to the upstream uncached.
+        ``before_wait`` runs once before a follower starts waiting; it may
+        raise to turn the follower away.
+        """
+        waiting = False
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached, False
+            with self.lock:
+                event = self.inflight.get(key)
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    self.counters["misses"] += 1
+                    return None, True
+                self.counters["coalesced"] += 1
+            if not waiting and before_wait is not None:
+                before_wait()
+            waiting = True
+            if not event.wait(self.wait_timeout):
+                return None, False
+            # the leader finished: its reply is in the cache, or it failed and the next loop elects a new leader
+
+    def release(self, key: str) -> None:
+        with self.lock:
+            event = self.inflight.pop(key, None)
+        if event is not None:
+            event.set()
 
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            con = self._db()
+            entries = con.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "inflight": len(self.inflight),
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            }
 
-def _rebuild_sqlite_from_excel(file_path: str) -> None:
-    """Rebuild a single SQLite database from the given Excel file.
-    - During rebuild, querying is disabled (handled by caller via flags)
-    - After successful rebuild, mark DATA_LOADED=True
-    Table schema columns: word_norm, word, phonetic, meaning, sheet, row_index
-    """
-    # Prepare excel reader (streaming)
-    from openpyxl import load_workbook
-    wb = load_workbook(filename=file_path, read_only=True, data_only=True)
-    sheets = [ws.title for ws in wb.worksheets]
 
-    # Create directory for DB if missing
-    os.makedirs(DATA_DIR, exist_ok=True)
+ai_cache = AIResponseCache()
 
-    # Create SQLite and write in one transaction
-    con = sqlite3.connect(SQLITE_DB_PATH)
-    cur = con.cursor()
-    try:
-        # Pragmas for faster build
-        cur.execute("PRAGMA journal_mode=WAL;")
-        cur.execute("PRAGMA synchronous=NORMAL;")
-        cur.execute("PRAGMA temp_store=MEMORY;")
 
-        cur.execute("DROP TABLE IF EXISTS entries;")
-        cur.execute(
-            """
-            CREATE TABLE entries (
-              id INTEGER PRIMARY KEY,
-              word_norm TEXT NOT NULL,
-              word TEXT,
-              phonetic TEXT,
-              meaning TEXT,
-              sheet TEXT,
-              row_index INTEGER
-            );
-            """
-        )
+class AIAdmissionRejected(Exception):
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
 
-        con.execute("BEGIN;")
+    def response(self) -> Response:
+        resp = jsonify({"error": self.message, "retry_after": self.retry_after})
+        resp.status_code = self.status
+        resp.headers["Retry-After"] = str(self.retry_after)
+        return resp
 
-        # Sampling config for preview
-        SAMPLE_STEP = 10
-        LATEST_LIMIT = 40
-        loading_state.clear_error()
 
-        insert_sql = (
-            "INSERT INTO entries (word_norm, word, phonetic, meaning, sheet, row_index) VALUES (?, ?, ?, ?, ?, ?)"
-        )
+class AIAdmission:
+    """Admission gate in front of upstream AI calls.
 
-        # We reuse total_words computed by caller; processed_words is reset in caller
-        for sheet in sheets:
-            loading_state.set_current_sheet(sheet)
-            ws = wb[sheet]
-            # choose word column index based on worksheet column count
-            max_cols = ws.max_column or 1
-            word_col_idx = 1 if max_cols > 1 else 0
-            # iterate and batch insert
-            batch: List[Tuple[str, Optional[str], Optional[str], Optional[str], str, int]] = []
-            for row_idx, row in enumerate(ws.iter_rows(values_only=True)):
-                if loading_cancelled:
-                    con.rollback()
-                    raise RuntimeError("loading cancelled")
-                # guard for row tuple shorter than expected
-                word_raw = row[word_col_idx] if word_col_idx < len(row or ()) else None
-                display_word = "" if word_raw is None else str(word_raw).strip()
-                norm = normalize_word(display_word)
-                # map optional columns 2 and 3 when present
-                phonetic_val = row[2] if (row and len(row) > 2) else None
-                meaning_val = row[3] if (row and len(row) > 3) else None
-                phonetic = None if phonetic_val is None else str(phonetic_val)
-                meaning = None if meaning_val is None else str(meaning_val)
-
-                batch.append((norm, display_word or None, phonetic, meaning, sheet, int(row_idx)))
-
-                processed_now = loading_state.increment_processed(
-                    increment=1,
-                    sample_word=display_word,
-                    sample_step=SAMPLE_STEP,
-                    latest_limit=LATEST_LIMIT,
-                )
+    At most ``max_active`` calls run at once, and up to ``max_queued`` more
+    wait in FIFO order; ``max_followers`` further requests may wait for an
+    identical in-flight call's reply (see ``follow``). Each session may hold
+    ``per_session`` slots of any kind. Anything beyond that is rejected at
+    once: 429 for the session limit, 503 when the slots are full or the wait
+    times out, both with Retry-After.
 
-                # flush in batches
-                if len(batch) >= 10000:
-                    cur.executemany(insert_sql, batch)
-                    batch.clear()
-                    # update percent after a chunk
+    Under WSGI a waiting request still occupies its worker thread, so the
+    gate is what bounds how many of waitress's threads AI traffic can hold.
+    Only cache hits skip it.
+    """
 
-            if batch:
-                cur.executemany(insert_sql, batch)
-                batch.clear()
+    def __init__(self, max_active: int = AI_MAX_ACTIVE, max_queued: int = AI_MAX_QUEUED,
+                 per_session: int = AI_SESSION_LIMIT, queue_timeout: float = AI_QUEUE_TIMEOUT,
+                 max_followers: int = AI_MAX_FOLLOWERS):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_followers = max_followers
+        self.following = 0
+        self.per_session = per_session
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.active = 0
+        self.queue: deque = deque()
+        self.sessions: Dict[str, int] = {}
+        self.avg_seconds = 10.0  # moving average of call duration, used for Retry-After
+        self.counters = {"admitted": 0, "followed": 0, "rejected_session": 0, "rejected_busy": 0, "timed_out": 0}
+
+    def _retry_after(self) -> int:
+        # caller holds self.cond
+        return max(1, math.ceil(self.avg_seconds * (len(self.queue) + 1) / self.max_active))
+
+    def _drop_session(self, session: str) -> None:
+        left = self.sessions.get(session, 0) - 1
+        if left > 0:
+            self.sessions[session] = left
+        else:
+            self.sessions.pop(session, None)
+
+    def _check_session(self, session: str) -> None:
+        # caller holds self.cond
+        if self.sessions.get(session, 0) >= self.per_session:
+            self.counters["rejected_session"] += 1
+            raise AIAdmissionRejected(429, "too many AI requests from this session", self._retry_after())
+
+    def follow(self, session: str) -> "AITicket":
+        """Slot for a single-flight follower; release it before calling ``enter``."""
+        with self.cond:
+            self._check_session(session)
+            if self.following >= self.max_followers:
+                self.counters["rejected_busy"] += 1
+                raise AIAdmissionRejected(503, "AI service busy", self._retry_after())
+            ticket = AITicket(self, session, follower=True)
+            self.sessions[session] = self.sessions.get(session, 0) + 1
+            self.following += 1
+            self.counters["followed"] += 1
+            return ticket
+
+    def enter(self, session: str) -> "AITicket":
+        with self.cond:
+            self._check_session(session)
+            if self.active >= self.max_active and len(self.queue) >= self.max_queued:
+                self.counters["rejected_busy"] += 1
+                raise AIAdmissionRejected(503, "AI service busy", self._retry_after())
+            ticket = AITicket(self, session)
+            self.sessions[session] = self.sessions.get(session, 0) + 1
+            self.queue.append(ticket)
+            deadline = time.monotonic() + self.queue_timeout
+            while not (self.queue[0] is ticket and self.active < self.max_active):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.queue.remove(ticket)
+                    self._drop_session(session)
+                    self.counters["timed_out"] += 1
+                    self.cond.notify_all()
+                    raise AIAdmissionRejected(503, "AI queue wait timed out", self._retry_after())
+                self.cond.wait(remaining)
+            self.queue.popleft()
+            self.active += 1
+            self.counters["admitted"] += 1
+            ticket.started = time.monotonic()
+            self.cond.notify_all()  # the next in line may fit as well
+            return ticket
+
+    def _release(self, ticket: "AITicket") -> None:
+        with self.cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._drop_session(ticket.session)
+            if ticket.follower:
+                self.following -= 1
+                return
+            self.active -= 1
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.monotonic() - ticket.started)
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                **self.counters,
+                "active": self.active,
+                "queued": len(self.queue),
+                "following": self.following,
+                "max_active": self.max_active,
+                "max_queued": self.max_queued,
+                "max_followers": self.max_followers,
+                "avg_seconds": round(self.avg_seconds, 2),
+            }
 
-        # index after all inserts
-        cur.execute("CREATE INDEX idx_entries_word_norm ON entries(word_norm);")
-        # speed up row lookup by (sheet,row_index)
-        cur.execute("CREATE INDEX idx_entries_sheet_row ON entries(sheet, row_index);")
 
-        con.commit()
+class AITicket:
+    __slots__ = ("gate", "session", "follower", "started", "released")
 
-        # mark loaded
-        app.config["DATA_LOADED"] = True
-        global current_excel_file
-        current_excel_file = file_path
-    finally:
-        con.close()
+    def __init__(self, gate: AIAdmission, session: str, follower: bool = False):
+        self.gate = gate
+        self.session = session
+        self.follower = follower
+        self.started = 0.0
+        self.released = False
 
- 
+    def release(self) -> None:
+        # idempotent: a stream may release from its generator and from call_on_close
+        self.gate._release(self)
 
 
-def _loader_worker(file_path: str):
-    global loading_thread, loading_cancelled
-    try:
-        file_name = os.path.basename(file_path)
-        total_rows = compute_total_rows(file_path)
-        loading_state.reset_for_file(file_name, total_rows)
-        loading_cancelled = False
-        _rebuild_sqlite_from_excel(file_path)
-    except Exception as exc:
-        loading_state.mark_finished(error=str(exc))
-    finally:
-        loading_state.mark_finished()
-        loading_thread = None
+ai_admission = AIAdmission()
 
 
-def list_txt_files() -> List[str]:
-    files: List[str] = []
-    if not os.path.isdir(DATA_DIR):
-        return files
-    for name in os.listdir(DATA_DIR):
-        path = os.path.join(DATA_DIR, name)
-        if os.path.isfile(path):
-            _, ext = os.path.splitext(name)
-            if ext.lower() in TXT_EXTENSIONS:
-                files.append(name)
-    # Sort by natural order when possible
-    files.sort(key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", s)])
-    return files
+def _ai_session_id() -> str:
+    return (
+        request.cookies.get(SITE_SESSION_COOKIE)
+        or request.cookies.get(COOKIE_NAME_PREFIX + "key")
+        or request.remote_addr
+        or "anonymous"
+    )
+
+
+def _server_timing(timing: Dict[str, float]) -> str:
+    return ", ".join(
+        f"upstream-{name[:-3]};dur={value}" for name, value in timing.items() if name.endswith("_ms")
+    )
 
 
 # -----------------------------
@@ -573,16 +2693,10 @@ def list_txt_files() -> List[str]:
 @app.route("/")
 def index():
     # 仅更新在线会话心跳
-    now = time.time()
     sess_id = request.cookies.get(SITE_SESSION_COOKIE, "")
     if not sess_id:
         sess_id = _get_token()
-    with online_sessions_lock:
-        online_sessions[sess_id] = now
-        # 清理过期
-        expired = [sid for sid, ts in list(online_sessions.items()) if now - ts > ONLINE_SESSION_TIMEOUT]
-        for sid in expired:
-            online_sessions.pop(sid, None)
+    site_presence.touch(sess_id)
     resp = make_response(render_template("index.html"))
     max_age = 30 * 24 * 3600
     resp.set_cookie(SITE_SESSION_COOKIE, sess_id, max_age=max_age)
@@ -596,26 +2710,40 @@ def api_txt_list():
 
 @app.route("/api/txt/content")
 def api_txt_content():
-    name = request.args.get("name", "").strip()
-    if not name:
-        return jsonify({"error": "missing name"}), 400
-    # Security: only allow files from base dir and with .txt
-    safe_name = os.path.basename(name)
-    _, ext = os.path.splitext(safe_name)
-    if ext.lower() not in TXT_EXTENSIONS:
-        return jsonify({"error": "invalid file type"}), 400
-    base = DATA_DIR if os.path.isdir(DATA_DIR) else BASE_DIR
-    file_path = os.path.join(base, safe_name)
-    if not os.path.exists(file_path):
+    try:
+        safe_name = safe_txt_name(request.args.get("name", ""))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    fmt = request.args.get("format", "text").strip().lower()
+    if fmt not in ("text", "tokens"):
+        return jsonify({"error": "invalid format"}), 400
+    entry = sentence_cache.get(safe_name)
+    if entry is None:
         return jsonify({"error": "file not found"}), 404
+    if fmt == "tokens":
+        return encoded_response(entry.tokens_body())
+    return encoded_response(entry.content)
+
+
+@app.route("/api/txt/lookups")
+def api_txt_lookups():
+    # 一次返回情境句文件中全部 [[word]] 的音标与释义，供前端预热查词卡片
+    if not app.config.get("DATA_LOADED", False):
+        return jsonify({"error": "loading or db not ready"}), 400
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return jsonify({"name": safe_name, "content": content})
-    except UnicodeDecodeError:
-        with open(file_path, "r", encoding="gb18030", errors="ignore") as f:
-            content = f.read()
-        return jsonify({"name": safe_name, "content": content})
+        safe_name = safe_txt_name(request.args.get("name", ""))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    entry = sentence_cache.get(safe_name)
+    if entry is None:
+        return jsonify({"error": "file not found"}), 404
+    try:
+        payload = _batch_lookup_payload(entry.token_norms())
+    except Exception as exc:
+        dictionary_pool.discard()
+        return jsonify({"error": f"db error: {exc}"}), 500
+    payload["name"] = safe_name
+    return jsonify(payload)
 
 
 @app.route("/api/excel/files")
@@ -629,12 +2757,12 @@ def api_excel_status():
     actual_ready = False
     try:
         if os.path.exists(SQLITE_DB_PATH):
-            con = sqlite3.connect(SQLITE_DB_PATH)
-            cur = con.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='entries'")
+            cur = dictionary_pool.connection().execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name='entries'"
+            )
             actual_ready = cur.fetchone() is not None
-            con.close()
     except Exception:
+        dictionary_pool.discard()
         actual_ready = False
     state = loading_state.snapshot()
     state.update({
@@ -647,17 +2775,32 @@ def api_excel_status():
 @app.route("/api/chat/online_count")
 def api_online_count():
     # 返回站点在线会话人数（用于首页展示，不要求已登录聊天室）
-    now = time.time()
-    with online_sessions_lock:
-        expired = [sid for sid, ts in list(online_sessions.items()) if now - ts > ONLINE_SESSION_TIMEOUT]
-        for sid in expired:
-            online_sessions.pop(sid, None)
-        return jsonify({"online": len(online_sessions)})
+    return jsonify({"online": len(site_presence)})
 
 
 @app.route("/api/excel/stream")
 def api_excel_stream():
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if not loading_state.try_watch():
+        # 推送名额已满：给出当前状态后立即结束，客户端改为轮询 /api/excel/status
+        _, frame = loading_state.sse_frame(bool(app.config.get("DATA_LOADED", False)))
+        busy_payload = {"event": "done", "busy": True, "timestamp": datetime.utcnow().isoformat()}
+        body = frame + f"data: {json.dumps(busy_payload, ensure_ascii=False)}\n\n"
+        return Response(body, mimetype="text/event-stream", headers=headers)
+    released = threading.Event()
+
+    def release() -> None:
+        if not released.is_set():
+            released.set()
+            loading_state.unwatch()
+
     def generate():
+        try:
+            yield from watch()
+        finally:
+            release()
+
+    def watch():
         try:
             max_seconds = float(request.args.get("duration", 10.0))
         except ValueError:
@@ -668,46 +2811,37 @@ def api_excel_stream():
             interval = float(request.args.get("interval", 0.5))
         except ValueError:
             interval = 0.5
-        interval = max(0.1, min(interval, 2.0))
+        interval = max(0.1, min(interval, 2.0))  # minimum spacing between frames
+        keepalive = max(2.0, interval * 3)
 
-        last_sent: Dict[str, Any] = {}
+        revision = -1
+        loaded = None
         last_emit_ts = 0.0
-        start_time = time.time()
+        deadline = time.monotonic() + max_seconds
 
         while True:
-            snapshot = loading_state.snapshot()
-            state = {
-                "loaded": bool(app.config.get("DATA_LOADED", False)),
-                **snapshot,
-            }
-
-            changed = False
-            if not last_sent:
-                changed = True
-            else:
-                if state.get("timestamp") != last_sent.get("timestamp"):
-                    changed = True
-                elif int(state.get("percent", -1)) != int(last_sent.get("percent", -1)):
-                    changed = True
-                elif state.get("running") != last_sent.get("running"):
-                    changed = True
-
-            now = time.time()
-            if changed or (now - last_emit_ts) >= max(2.0, interval * 3):
-                last_sent = state
-                last_emit_ts = now
-                yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
-
-            if now - start_time >= max_seconds:
+            now = time.monotonic()
+            if now >= deadline:
                 break
-
-            time.sleep(interval)
+            current_loaded = bool(app.config.get("DATA_LOADED", False))
+            if current_loaded != loaded or now - last_emit_ts >= keepalive or loading_state.revision != revision:
+                loaded = current_loaded
+                revision, frame = loading_state.sse_frame(loaded)
+                last_emit_ts = now
+                yield frame
+            # 仅在状态变化（或心跳/截止时间）时醒来，不再定时轮询
+            loading_state.wait_for_change(revision, min(keepalive, max(0.0, deadline - time.monotonic())))
+            gap = interval - (time.monotonic() - last_emit_ts)
+            if gap > 0:
+                time.sleep(min(gap, max(0.0, deadline - time.monotonic())))  # coalesce bursts of updates
 
         closing_payload = {"event": "done", "timestamp": datetime.utcnow().isoformat()}
         yield f"data: {json.dumps(closing_payload, ensure_ascii=False)}\n\n"
 
-    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
-    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    # the generator releases when it ends; this covers a stream closed before it started
+    resp.call_on_close(release)
+    return resp
 
 
 @app.route("/api/excel/load", methods=["POST"])
@@ -718,33 +2852,43 @@ def api_excel_load():
     allowed = {f["name"] for f in files}
     if not file_name or file_name not in allowed:
         return jsonify({"error": "invalid file"}), 400
+    mode = request.args.get("mode", "full").strip().lower()
+    if mode not in ("full", "incremental"):
+        return jsonify({"error": "invalid mode"}), 400
+    pipeline = request.args.get("pipeline", "bulk").strip().lower()
+    if pipeline not in IMPORT_PIPELINES:
+        return jsonify({"error": "invalid pipeline"}), 400
     if loading_state.snapshot().get("running"):
         return jsonify({"error": "loading in progress"}), 409
-    # reset state
-    app.config["DATA_LOADED"] = False
-    current_excel_file = None
-    # remove existing sqlite db if any (fresh rebuild as requested)
-    try:
-        if os.path.exists(SQLITE_DB_PATH):
-            os.remove(SQLITE_DB_PATH)
-    except Exception:
-        pass
-    # clear legacy in-memory structures (no longer used)
+    incremental = mode == "incremental"
+    if not incremental:
+        # reset state
+        _set_data_loaded(False)
+        current_excel_file = None
+        # remove existing sqlite db if any (fresh rebuild as requested)
+        _invalidate_dictionary_db()
+        try:
+            if os.path.exists(SQLITE_DB_PATH):
+                os.remove(SQLITE_DB_PATH)
+        except Exception:
+            pass
+    # incremental: keep serving the live db while the shadow copy is built
     # start thread
     file_path = os.path.join(BASE_DIR, file_name)
-    t = threading.Thread(target=_loader_worker, args=(file_path,), daemon=True)
+    t = threading.Thread(target=_loader_worker, args=(file_path, incremental, pipeline), daemon=True)
     loading_thread = t
     t.start()
-    return jsonify({"started": True})
+    return jsonify({"started": True, "mode": mode, "pipeline": pipeline})
 
 
 @app.route("/api/excel/unload", methods=["POST"])
 def api_excel_unload():
     global current_excel_file
-    app.config["DATA_LOADED"] = False
+    _set_data_loaded(False)
     current_excel_file = None
     # clear legacy in-memory structures (no longer used)
     # delete sqlite db file as well
+    _invalidate_dictionary_db()
     try:
         if os.path.exists(SQLITE_DB_PATH):
             os.remove(SQLITE_DB_PATH)
@@ -761,11 +2905,13 @@ def api_ai_chat():
         content = (data.get("content") or "").strip()
         model = (data.get("model") or "Qwen/QwQ-32B").strip()
         system = (data.get("system") or "").strip()
+        stream = bool(data.get("stream", False))
+        include_raw = bool(data.get("raw", True))  # raw=false drops the upstream JSON from the reply
+        use_cache = bool(data.get("cache", True))
         if not api_key:
             return jsonify({"error": "missing api_key"}), 400
         if not content:
             return jsonify({"error": "missing content"}), 400
-        url = "https://api.siliconflow.cn/v1/chat/completions"
         messages = []
         if system:
             messages.append({"role": "system", "content": system})
@@ -774,27 +2920,182 @@ def api_ai_chat():
             "model": model,
             "messages": messages,
         }
+        if stream:
+            payload["stream"] = True
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
-        r = requests.post(url, json=payload, headers=headers, timeout=60)
+        key = ai_cache.key(model, system, content) if use_cache else None
+        credential = ai_cache.credential(api_key)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
+    cache_key = None
+    store_key = None  # where a good reply is stored: the leader's key, or an unverified caller's
+    ticket = None
+    try:
+        session = _ai_session_id()
+        if key and not ai_cache.is_verified(credential):
+            # this api key has not been accepted upstream yet: no hits until it has
+            store_key = key
+        elif key:
+            # hits skip admission; a single-flight follower waits for the leader's
+            # reply in a capped follower slot instead of an upstream slot
+            following: List[AITicket] = []
+            try:
+                cached, leader = ai_cache.acquire(key, lambda: following.append(ai_admission.follow(session)))
+            finally:
+                for held in following:
+                    held.release()
+            if cached is not None:
+                return _ai_cached_response(cached, stream)
+            cache_key = store_key = key if leader else None
+        ticket = ai_admission.enter(session)
+        r, timing = ai_client.post("/chat/completions", payload, headers, stream=stream)
+        if r.ok:
+            ai_cache.verify(credential)
+        if stream:
+            held_key, held_ticket = cache_key, ticket
+
+            def release() -> None:
+                if held_key:
+                    ai_cache.release(held_key)
+                held_ticket.release()
+
+            resp = _ai_stream_response(r, timing, model, store_key, release)
+            # the generator releases when it ends; this covers a stream closed before it started
+            resp.call_on_close(release)
+            cache_key, ticket = None, None
+            return resp
         r.raise_for_status()
         dj = r.json()
         msg = None
+        finish_reason = None
         try:
-            msg = dj.get("choices", [{}])[0].get("message", {}).get("content", None)
+            choice = dj.get("choices", [{}])[0]
+            msg = choice.get("message", {}).get("content", None)
+            finish_reason = choice.get("finish_reason")
         except Exception:
             msg = None
         cleaned = "" if msg is None else str(msg).lstrip("\r\n")
-        return jsonify({
+        body = {
             "message": cleaned,
-            "raw": dj,
-        })
+            "timing": timing,
+        }
+        if include_raw:
+            body["raw"] = dj
+        # same rule as the stream relay: truncated (finish_reason "length") replies are not stored
+        if store_key and cleaned and finish_reason == "stop":
+            ai_cache.put(store_key, model, cleaned, dj.get("usage"))
+        resp = jsonify(body)
+        resp.headers["Server-Timing"] = _server_timing(timing)
+        return resp
+    except AIAdmissionRejected as rejected:
+        return rejected.response()
     except requests.HTTPError as http_err:
         return jsonify({"error": f"http {http_err.response.status_code}", "detail": http_err.response.text}), 502
     except Exception as exc:
         return jsonify({"error": str(exc)}), 500
+    finally:
+        if cache_key:
+            ai_cache.release(cache_key)
+        if ticket is not None:
+            ticket.release()
+
+
+@app.route("/api/ai/stats")
+def api_ai_stats():
+    return jsonify({"cache": ai_cache.stats(), "admission": ai_admission.stats()})
+
+
+def _ai_cached_response(cached: Dict[str, Any], stream: bool) -> Response:
+    # 命中缓存：不访问上游；流式请求也按同样的帧格式一次性返回
+    body = {"message": cached["message"], "usage": cached["usage"], "cached": True}
+    if not stream:
+        return jsonify(body)
+    frames = (
+        f"data: {json.dumps({'delta': cached['message']}, ensure_ascii=False)}\n\n"
+        f"data: {json.dumps({'event': 'done', 'finish_reason': 'stop', **body}, ensure_ascii=False)}\n\n"
+    )
+    return Response(frames, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def _ai_stream_response(r: requests.Response, timing: Dict[str, float], model: str = "",
+                        cache_key: Optional[str] = None, release=None) -> Response:
+    """Relay upstream chat-completion deltas as SSE frames.
+
+    Frames are ``{"delta": "..."}`` followed by one compact
+    ``{"event": "done", ...}`` frame. If the browser disconnects, the server
+    closes this generator and the finally block drops the upstream
+    connection. A reply that finished with ``finish_reason == "stop"`` is
+    stored under ``cache_key``; ``release`` frees the cache key and admission
+    slot once the stream ends.
+    """
+    try:
+        r.raise_for_status()
+    except requests.HTTPError:
+        detail = r.text
+        r.close()
+        if release is not None:
+            release()
+        resp = jsonify({"error": f"http {r.status_code}", "detail": detail})
+        resp.status_code = 502
+        return resp
+    started = time.perf_counter()
+
+    def generate():
+        parts: List[str] = []
+        finish_reason = None
+        usage = None
+        first_token_ms = None
+        try:
+            for line in r.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == b"[DONE]":
+                    break
+                try:
+                    obj = json.loads(chunk)
+                except ValueError:
+                    continue
+                choice = (obj.get("choices") or [{}])[0]
+                finish_reason = choice.get("finish_reason") or finish_reason
+                usage = obj.get("usage") or usage
+                delta = (choice.get("delta") or {}).get("content")
+                if not parts and delta:
+                    delta = delta.lstrip("\r\n")  # same trimming as the non-streaming reply
+                if not delta:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = round(timing["total_ms"] + (time.perf_counter() - started) * 1000, 1)
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            final = {
+                "event": "done",
+                "message": "".join(parts),
+                "finish_reason": finish_reason,
+                "usage": usage,
+                "timing": {**timing, "first_token_ms": first_token_ms,
+                           "total_ms": round(timing["total_ms"] + (time.perf_counter() - started) * 1000, 1)},
+            }
+            if cache_key and parts and finish_reason == "stop":
+                ai_cache.put(cache_key, model, final["message"], usage)
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+        except requests.RequestException as exc:
+            yield f"data: {json.dumps({'event': 'error', 'error': str(exc)}, ensure_ascii=False)}\n\n"
+        finally:
+            r.close()
+            if release is not None:
+                release()
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        # the upstream body is still streaming, so only setup and TTFB are known here
+        "Server-Timing": _server_timing({k: v for k, v in timing.items() if k != "total_ms"}),
+    }
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
 
 @app.route("/api/excel/search")
 def api_excel_search():
@@ -804,10 +3105,13 @@ def api_excel_search():
     if not word:
         return jsonify({"error": "missing word"}), 400
     norm = normalize_word(word)
+    index = dictionary_index
+    if index is not None:
+        entry = index.lookup(norm)
+        matches = [] if entry is None else [{"sheet": entry.sheet, "row_index": entry.row_index}]
+        return jsonify({"word": word, "normalized": norm, "count": len(matches), "matches": matches})
     try:
-        con = sqlite3.connect(SQLITE_DB_PATH)
-        cur = con.cursor()
-        cur.execute(
+        cur = dictionary_pool.connection().execute(
             "SELECT sheet, row_index FROM entries WHERE word_norm = ? LIMIT 1",
             (norm,),
         )
@@ -815,9 +3119,9 @@ def api_excel_search():
         matches: List[Dict[str, Any]] = []
         for s, r in rows:
             matches.append({"sheet": s, "row_index": int(r) if r is not None else 0})
-        con.close()
         return jsonify({"word": word, "normalized": norm, "count": len(matches), "matches": matches})
     except Exception as exc:
+        dictionary_pool.discard()
         return jsonify({"error": f"db error: {exc}"}), 500
 
 
@@ -829,15 +3133,18 @@ def api_lookup():
     if not word:
         return jsonify({"error": "missing word"}), 400
     norm = normalize_word(word)
+    index = dictionary_index
+    if index is not None:
+        entry = index.lookup(norm)
+        if entry is None:
+            return jsonify({"error": "not found"}), 404
+        return jsonify({"word": word, "row": {"1": entry.word, "2": entry.phonetic, "3": entry.meaning}})
     try:
-        con = sqlite3.connect(SQLITE_DB_PATH)
-        cur = con.cursor()
-        cur.execute(
+        cur = dictionary_pool.connection().execute(
             "SELECT word, phonetic, meaning FROM entries WHERE word_norm = ? LIMIT 1",
             (norm,),
         )
         result = cur.fetchone()
-        con.close()
         if not result:
             return jsonify({"error": "not found"}), 404
         w, phonetic, meaning = result
@@ -848,8 +3155,60 @@ def api_lookup():
         }
         return jsonify({"word": word, "row": row_obj})
     except Exception as exc:
+        dictionary_pool.discard()
+        return jsonify({"error": f"db error: {exc}"}), 500
+
+@app.route("/api/lookup/batch", methods=["POST"])
+def api_lookup_batch():
+    if not app.config.get("DATA_LOADED", False):
+        return jsonify({"error": "loading or db not ready"}), 400
+    data = request.get_json(silent=True) or {}
+    words = data.get("words")
+    if not isinstance(words, list) or not words:
+        return jsonify({"error": "missing words"}), 400
+    if len(words) > BATCH_LOOKUP_LIMIT:
+        return jsonify({"error": f"too many words (max {BATCH_LOOKUP_LIMIT})"}), 400
+    try:
+        return jsonify(_batch_lookup_payload(str(w) for w in words if w is not None))
+    except Exception as exc:
+        dictionary_pool.discard()
         return jsonify({"error": f"db error: {exc}"}), 500
 
+@app.route("/api/vocab/word")
+def api_vocab_word():
+    # 查询单词的 COCA 词频排名及其所在情境句文件
+    word = request.args.get("word", "").strip()
+    if not word:
+        return jsonify({"error": "missing word"}), 400
+    norm = normalize_word(word)
+    try:
+        entry = get_vocabulary_index().lookup(norm)
+    except Exception as exc:
+        return jsonify({"error": f"vocab error: {exc}"}), 500
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    payload = _vocab_payload(entry)
+    payload.update({"query": word, "normalized": norm})
+    return jsonify(payload)
+
+
+@app.route("/api/vocab/rank")
+def api_vocab_rank():
+    try:
+        rank = int(request.args.get("rank", "0"))
+    except ValueError:
+        rank = 0
+    if rank <= 0:
+        return jsonify({"error": "missing rank"}), 400
+    try:
+        entry = get_vocabulary_index().rank(rank)
+    except Exception as exc:
+        return jsonify({"error": f"vocab error: {exc}"}), 500
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(_vocab_payload(entry))
+
+
 @app.route("/api/excel/row")
 def api_excel_row():
     if not app.config.get("DATA_LOADED", False):
@@ -861,15 +3220,22 @@ def api_excel_row():
         row_index = -1
     if not sheet or row_index < 0:
         return jsonify({"error": "missing sheet or row_index"}), 400
+    index = dictionary_index
+    if index is not None:
+        entry = index.row(sheet, row_index)
+        if entry is None:
+            return jsonify({"error": "not found"}), 404
+        return jsonify({
+            "sheet": sheet,
+            "row_index": row_index,
+            "row": {"1": entry.word, "2": entry.phonetic, "3": entry.meaning},
+        })
     try:
-        con = sqlite3.connect(SQLITE_DB_PATH)
-        cur = con.cursor()
-        cur.execute(
+        cur = dictionary_pool.connection().execute(
             "SELECT word, phonetic, meaning FROM entries WHERE sheet = ? AND row_index = ?",
             (sheet, row_index),
         )
         result = cur.fetchone()
-        con.close()
         if not result:
             return jsonify({"error": "not found"}), 404
         word_text, phonetic, meaning = result
@@ -884,6 +3250,7 @@ def api_excel_row():
             "row": row_obj,
         })
     except Exception as exc:
+        dictionary_pool.discard()
         return jsonify({"error": f"db error: {exc}"}), 500
 
 
@@ -891,9 +3258,78 @@ def api_excel_row():
 # Chat Routes (integrated)
 # -----------------------------
 
+UPLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"  # upload names are never reused
+CONTENT_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _upload_body(path: str, start: int, length: int):
+    f = open(path, "rb")
+    f.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None:
+        # waitress sends from the current offset up to Content-Length without
+        # copying through this worker thread
+        return file_wrapper(f, 256 * 1024)
+
+    def read_range():
+        try:
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(256 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    return read_range()
+
+
 @app.route("/uploads/<path:filename>")
 def chat_uploaded_file(filename: str):
-    return send_from_directory(UPLOAD_DIR, filename)
+    # 点开头的路径（如 .incoming 里写到一半的临时文件）不对外提供
+    if any(part.startswith(".") for part in filename.replace("\\", "/").split("/")):
+        return Response("Not Found", status=404)
+    path = safe_join(UPLOAD_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return Response("Not Found", status=404)
+    st = os.stat(path)
+    size = st.st_size
+    stem = os.path.splitext(os.path.basename(path))[0]
+    # 按内容哈希命名的文件直接以哈希作 ETag，旧文件退回 mtime-size
+    etag = stem if CONTENT_HASH_RE.match(stem) else f"{st.st_mtime_ns:x}-{size:x}"
+    headers = {"Cache-Control": UPLOAD_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+    start, length, status = 0, size, 200
+    rng = request.range
+    if_range = request.if_range
+    if if_range.etag is not None:
+        range_valid = if_range.etag == etag
+    elif if_range.date is not None:
+        range_valid = int(st.st_mtime) <= if_range.date.timestamp()
+    else:
+        range_valid = True
+    # 多段 Range 不拼 multipart/byteranges，按规范忽略 Range 返回整个文件
+    if rng is not None and range_valid and rng.units == "bytes" and len(rng.ranges) == 1:
+        span = rng.range_for_length(size)
+        if span is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = span
+        length, status = stop - start, 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    body = [] if request.method == "HEAD" else _upload_body(path, start, length)
+    resp = Response(body, status=status, mimetype=mimetype,
+                    headers=headers, direct_passthrough=True)
+    resp.content_length = length
+    resp.set_etag(etag)
+    resp.last_modified = st.st_mtime
+    return resp
 
 
 @app.route("/login", methods=["POST"])
@@ -903,8 +3339,7 @@ def chat_login():
     if not nickname:
         nickname = _rand_nick()
     user_key = _get_token()
-    _update_online_status()
-    online_users[user_key] = {"name": nickname, "last_active": time.time()}
+    chat_presence.touch(user_key, name=nickname)
     online_now = get_site_online_count()
     _add_system_message(f"欢迎 <strong>{nickname}</strong> 加入:) <span class=\"tips-warning\">当前在线人数：{online_now}</span>")
     resp = make_response(jsonify({
@@ -922,8 +3357,8 @@ def chat_login():
 def chat_logout():
     username = request.cookies.get(COOKIE_NAME_PREFIX + "name", "")
     user_key = request.cookies.get(COOKIE_NAME_PREFIX + "key", "")
-    if user_key in online_users:
-        online_users.pop(user_key, None)
+    if user_key in chat_presence:
+        chat_presence.discard(user_key)
         online_now = get_site_online_count()
         _add_system_message(f"<strong>{username}</strong> 已退出 <span class=\"tips-warning\">当前在线人数：{online_now}</span>")
     return jsonify({"result": "success", "version": _get_current_version()})
@@ -932,8 +3367,7 @@ def chat_logout():
 @app.route("/heartbeat", methods=["POST"])
 def chat_heartbeat():
     user_key = request.cookies.get(COOKIE_NAME_PREFIX + "key", "")
-    if user_key in online_users:
-        online_users[user_key]["last_active"] = time.time()
+    _touch_chat_user(user_key)
     return jsonify({"result": "success"})
 
 
@@ -944,13 +3378,11 @@ def chat_send():
         return jsonify({"result": "error", "message": "消息不能为空"}), 400
     username = request.cookies.get(COOKIE_NAME_PREFIX + "name", "匿名")
     user_key = request.cookies.get(COOKIE_NAME_PREFIX + "key", "")
-    if user_key in online_users:
-        online_users[user_key]["last_active"] = time.time()
+    _touch_chat_user(user_key)
     if message == "/rm127.0.0.1":
         clear_messages()
         _clear_uploads()
-        new_v = _increment_version()
-        _add_system_message("💥 已清空所有聊天记录与上传文件！")
+        _, new_v = add_messages([_system_message("💥 已清空所有聊天记录与上传文件！")], bump_version=True)
         return jsonify({"result": "success", "version": new_v, "admin_clear": True})
     msg_obj = {
         "type": "msg",
@@ -967,32 +3399,32 @@ def chat_send():
 def chat_upload():
     username = request.cookies.get(COOKIE_NAME_PREFIX + "name", "匿名")
     user_key = request.cookies.get(COOKIE_NAME_PREFIX + "key", "")
-    if user_key in online_users:
-        online_users[user_key]["last_active"] = time.time()
-    if 'files[]' not in request.files:
+    _touch_chat_user(user_key)
+    try:
+        # 解析时即流式写盘并计算哈希，超限立即中止
+        has_files = 'files[]' in request.files
+    except RequestEntityTooLarge:
+        return jsonify({'result': 'error', 'message': '文件超过大小限制 (50MB)'}), 400
+    if not has_files:
         return jsonify({'result': 'error', 'message': '没有选择文件'}), 400
     files = request.files.getlist('files[]')
     if not files or all(f.filename == '' for f in files):
         return jsonify({'result': 'error', 'message': '没有选择文件'}), 400
     uploaded_files = []
+    file_msgs = []
     for file in files:
         if not file or file.filename == '':
             continue
         if not _allowed_file(file.filename):
             continue
-        file.seek(0, os.SEEK_END)
-        size = file.tell()
-        file.seek(0)
-        if size > MAX_FILE_SIZE:
-            return jsonify({'result': 'error', 'message': f'文件 {file.filename} 超过大小限制 (50MB)'}), 400
-        from werkzeug.utils import secure_filename
+        blob: HashingUploadFile = file.stream
+        size = blob.size
         original_filename = secure_filename(file.filename)
-        unique_filename = _unique_filename(original_filename)
-        save_path = os.path.join(UPLOAD_DIR, unique_filename)
-        file.save(save_path)
+        # 按内容哈希存储：相同文件只保存一份
+        stored_filename = blob.store(file.filename)
         file_info = {
             'name': original_filename,
-            'filename': unique_filename,
+            'filename': stored_filename,
             'size': size,
             'type': _get_file_type(original_filename),
         }
@@ -1003,35 +3435,100 @@ def chat_upload():
             'fileInfo': file_info,
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'),
         }
-        add_message(msg)
+        file_msgs.append(msg)
         uploaded_files.append(file_info)
-    new_v = _increment_version()
+    # 所有文件消息与版本号一次提交
+    _, new_v = add_messages(file_msgs, bump_version=True)
     return jsonify({'result': 'success', 'files': uploaded_files, 'version': new_v})
 
 
 @app.route("/msg", methods=["GET"])
 def chat_get_messages():
-    # 始终返回最新的100条消息（从末尾往前），忽略客户端 last_index
-    last_index = int(request.args.get('k', 0))  # 兼容参数，不用于筛选
     client_version = int(request.args.get('v', 0))
     server_version = _get_current_version()
-    _update_online_status()
     if client_version != server_version:
         return jsonify({'reset': True, 'version': server_version})
-    total = chat_total_messages()
-    # 仅返回最后100条
-    start_index = max(0, total - 100)
-    limit = min(100, total - start_index)
-    raw_list = chat_fetch_messages(start_index, limit)
-    users = set()
-    for s in raw_list:
+    since_arg = request.args.get('since')
+    if since_arg is None:
+        return _chat_messages_legacy(server_version)
+    return _chat_messages_since(_parse_since(since_arg), server_version)
+
+
+def _parse_since(value: Optional[str]) -> int:
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        return 0
+
+
+def _chat_messages_since(since: int, server_version: int):
+    # 增量协议：客户端携带已见过的最大消息 id，仅返回更新的消息
+    last_id = message_cache["last_id"]
+    if since > last_id:
+        # ids are assigned in memory and can go backwards after an unclean exit
+        return jsonify({'reset': True, 'version': server_version, 'last_id': last_id})
+
+    def build() -> EncodedBody:
+        if since >= last_id:
+            return EncodedBody.from_json({'list': [], 'last_id': last_id, 'version': server_version})
+        rows = chat_fetch_since(since)
+        return EncodedBody.from_json({
+            'list': [content for _, content in rows],
+            'last_id': rows[-1][0] if rows else last_id,
+            'version': server_version,
+            'users': chat_recent_users(),
+        })
+
+    return encoded_response(chat_responses.get((server_version, last_id), since, build))
+
+
+@app.route("/msg/wait", methods=["GET"])
+def chat_wait_messages():
+    # 长轮询：没有新消息时阻塞等待，顺带刷新心跳
+    user_key = request.cookies.get(COOKIE_NAME_PREFIX + "key", "")
+    _touch_chat_user(user_key)
+    try:
+        client_version = int(request.args.get('v', 0))
+    except ValueError:
+        client_version = 0
+    since = _parse_since(request.args.get('since'))
+    try:
+        timeout = float(request.args.get('timeout', CHAT_WAIT_TIMEOUT))
+    except ValueError:
+        timeout = CHAT_WAIT_TIMEOUT
+    timeout = max(1.0, min(timeout, CHAT_WAIT_TIMEOUT))
+    server_version = _get_current_version()
+    if client_version != server_version:
+        return jsonify({'reset': True, 'version': server_version})
+
+    def changed() -> bool:
+        # since beyond last_id: ids went backwards (unclean exit), answer with a reset at once
+        return message_cache["version"] != client_version or message_cache["last_id"] != since
+
+    if not changed():
+        if not chat_notifier.try_enter():
+            # 等待名额已满：让客户端退回定时轮询
+            return jsonify({'list': [], 'last_id': message_cache["last_id"],
+                            'version': message_cache["version"], 'busy': True})
         try:
-            obj = json.loads(s)
-            if isinstance(obj, dict) and obj.get('type') == 'msg' and obj.get('name'):
-                users.add(obj['name'])
-        except Exception:
-            pass
-    return jsonify({'count': total, 'list': raw_list, 'version': server_version, 'users': list(users)})
+            chat_notifier.wait_for(changed, timeout)
+        finally:
+            chat_notifier.leave()
+    server_version = _get_current_version()
+    if client_version != server_version:
+        return jsonify({'reset': True, 'version': server_version})
+    return _chat_messages_since(since, server_version)
+
+
+def _chat_messages_legacy(server_version: int):
+    # 旧协议：始终返回最新的100条消息（从末尾往前），忽略客户端 k
+    def build() -> EncodedBody:
+        total = chat_total_messages()
+        raw_list = [content for _, content in chat_buffer.latest(CHAT_RECENT_LIMIT)]
+        users = {n for n in map(_message_sender, raw_list) if n}
+        return EncodedBody.from_json({'count': total, 'list': raw_list, 'version': server_version, 'users': list(users)})
+
+    return encoded_response(chat_responses.get((server_version, message_cache["last_id"]), "legacy", build))
 
 
 # No auto-loading. Data is loaded via /api/excel/load
@@ -1049,8 +3546,9 @@ if __name__ == "__main__":
             exists = cur.fetchone() is not None
             con.close()
             if exists:
-                app.config["DATA_LOADED"] = True
+                _set_data_loaded(True)
                 db_ready = True
+                _publish_dictionary_db()
                 # Best-effort set current excel file for UI display
                 data_xlsx_path = os.path.join(BASE_DIR, "data.xlsx")
                 if os.path.exists(data_xlsx_path):
@@ -1068,7 +3566,7 @@ if __name__ == "__main__":
                 auto_excel_path = os.path.join(BASE_DIR, auto_excel)
                 is_main_worker = (os.environ.get("WERKZEUG_RUN_MAIN") == "true") or not bool(os.environ.get("WERKZEUG_RUN_MAIN"))
                 if os.path.exists(auto_excel_path) and is_main_worker and not loading_state.snapshot().get("running"):
-                    app.config["DATA_LOADED"] = False
+                    _set_data_loaded(False)
                     try:
                         if os.path.exists(SQLITE_DB_PATH):
                             os.remove(SQLITE_DB_PATH)
@@ -1090,7 +3588,7 @@ if __name__ == "__main__":
         app, 
         host="0.0.0.0", 
         port=5000,
-        threads=10,             # 适合2核CPU的线程数
+        threads=WAITRESS_THREADS,  # 适合2核CPU的线程数
         connection_limit=500,   # 适合2GB内存的连接数
         channel_timeout=120     # 连接超时时间(秒)
     )
@@ -0,0 +1,67 @@
+"""Excel parsing shared by app.py and the parallel import workers.
+
+Spawned import workers unpickle ``parse_sheet`` from this module, so it
+must stay free of import-time side effects: no Flask app, no databases,
+no state files.
+"""
+import itertools
+from typing import Any, List, Optional, Tuple
+
+import pandas as pd
+
+EntryRow = Tuple[str, Optional[str], Optional[str], Optional[str], str, int]
+
+
+def open_workbook(file_path: str):
+    from openpyxl import load_workbook
+    return load_workbook(filename=file_path, read_only=True, data_only=True)
+
+
+def normalize_words(values: "pd.Series") -> Tuple["pd.Series", "pd.Series"]:
+    """Vectorized normalize_word: returns (display_word, word_norm) columns."""
+    display = values.fillna("").astype(str).str.strip()
+    norm = display.str.replace(r"[^A-Za-z\-']+", " ", regex=True).str.strip().str.lower()
+    return display, norm
+
+
+def word_column(ws) -> int:
+    # choose word column index based on worksheet column count
+    max_cols = ws.max_column or 1
+    return 1 if max_cols > 1 else 0
+
+
+def rows_to_entries(rows: List[Tuple[Any, ...]], word_col_idx: int, sheet: str,
+                    offset: int) -> Tuple[List[EntryRow], List[str]]:
+    """Normalize a chunk of raw worksheet rows; returns (entries, display words)."""
+    words = pd.Series(
+        [row[word_col_idx] if row and word_col_idx < len(row) else None for row in rows],
+        dtype=object,
+    )
+    display, norm = normalize_words(words)
+    phonetics = [None if not row or len(row) <= 2 or row[2] is None else str(row[2]) for row in rows]
+    meanings = [None if not row or len(row) <= 3 or row[3] is None else str(row[3]) for row in rows]
+    display_list = display.tolist()
+    entries: List[EntryRow] = list(zip(
+        norm.tolist(),
+        [w or None for w in display_list],
+        phonetics,
+        meanings,
+        itertools.repeat(sheet),
+        range(offset, offset + len(rows)),
+    ))
+    return entries, display_list
+
+
+def parse_sheet(file_path: str, sheet: str) -> Tuple[List[EntryRow], List[str]]:
+    """Process-pool task: parse and normalize one whole sheet.
+
+    Read-only openpyxl still has to parse every row before ``min_row``, so
+    sheets are never split into row ranges; one worker streams each sheet.
+    """
+    wb = open_workbook(file_path)
+    try:
+        ws = wb[sheet]
+        rows = list(ws.iter_rows(values_only=True))
+        return rows_to_entries(rows, word_column(ws), sheet, 0)
+    finally:
+        wb.close()
@@ -75,11 +75,21 @@ async function sendMessage() {
     const response = await fetch('/api/ai/chat', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ content, api_key: apiKey, model, system }),
+      body: JSON.stringify({ content, api_key: apiKey, model, system, stream: true, raw: false }),
     });
+    if (response.status === 429 || response.status === 503) {
+      const retry = response.headers.get('Retry-After') || '';
+      throw new Error(`智能体繁忙，请${retry ? ` ${retry} 秒后` : '稍后'}重试`);
+    }
     if (!response.ok) throw new Error(`HTTP ${response.status}`);
-    const data = await response.json();
-    appendBotBubble(data?.message || '[空回复]');
+    const type = response.headers.get('Content-Type') || '';
+    if (!response.body || !type.includes('text/event-stream')) {
+      const data = await response.json();
+      appendBotBubble(data?.message || '[空回复]');
+      return;
+    }
+    const message = await readReplyStream(response.body);
+    appendBotBubble(message || '[空回复]');
   } catch (error) {
     appendBotBubble(`请求失败：${error.message}`);
   } finally {
@@ -87,6 +97,44 @@ async function sendMessage() {
   }
 }
 
+// 逐段读取 SSE：{"delta": "..."} 追加到气泡，{"event": "done"} 携带完整回复
+async function readReplyStream(body) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+      const line = frame.split('\n').find((l) => l.startsWith('data:'));
+      if (!line) continue;
+      const data = JSON.parse(line.slice(5));
+      if (data.event === 'error') throw new Error(data.error || 'stream error');
+      if (data.event === 'done') {
+        reader.cancel().catch(() => {});
+        return data.message ?? text;
+      }
+      if (data.delta) {
+        text += data.delta;
+        updatePendingBubble(text);
+      }
+    }
+  }
+  return text;
+}
+
+function updatePendingBubble(text) {
+  if (!pendingBubble) return;
+  pendingBubble.textContent = text;
+  scrollToBottom();
+}
+
 function appendUserBubble(text) {
   if (!els.aiList) return;
   const bubble = document.createElement('div');
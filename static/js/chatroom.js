@@ -1,5 +1,6 @@
 // 全局变量
 var k = 0; // 已读消息计数
+var lastId = 0; // 已收到的最大消息 id（增量拉取）
 var version = 0; // 消息版本号
 var c; // 消息轮询定时器
 var h; // 心跳定时器
@@ -14,7 +15,6 @@ var pollingTimerLastInterval = 2000; // 上次定时器间隔
 var pollingTimerLastResetTs = 0; // 上次重建定时器时间戳
 var lastRenderSignature = null; // 上次渲染签名，避免重复重绘导致闪烁
 var pendingSelfScroll = false; // 自己发送后，下一次拉取强制滚动到底
-var lastMsgSignature = null; // 上一次渲染的最后一条原始消息，用于增量判断
 
 // 私聊系统状态
 var currentView = 'group'; // 'group', 'private-dropdown', 'private-chat'
@@ -174,6 +174,8 @@ $(document).ready(function() {
         $('#back-btn').hide();
         $('#login-section').show();
         
+        longPollEnabled = false;
+        longPollActive = false;
         if (c) {
             clearInterval(c);
             c = null;
@@ -215,6 +217,8 @@ function isAtBottom() {
 
 // 发送心跳
 function sendHeartbeat() {
+    // 长轮询请求本身会刷新在线状态
+    if (longPollActive) return;
     $.post("/heartbeat", {}, function() {}, "json");
 }
 
@@ -339,6 +343,7 @@ function handleAdminClearAll() {
     // 8. 清空管理员自己的聊天界面
     $('#chat-box').empty();
     k = 0; // 重置消息计数
+    lastId = 0;
     
     // 9. 延迟重置标志，确保所有检查都完成
     setTimeout(function() {
@@ -669,139 +674,19 @@ $(document).on('click', '#image-modal', function(e) {
 // 私聊邀请与列表逻辑已移除
 
 function get_msg() {
-    // 仅群聊逻辑，防抖：防止并发请求导致重复消息
-    if (isFetchingMessages) {
+    // 仅群聊逻辑，防抖：防止并发请求导致重复消息；长轮询期间不再定时拉取
+    if (isFetchingMessages || longPollActive) {
         return;
     }
     isFetchingMessages = true;
     
-    $.getJSON("/msg?k=" + k + "&v=" + version, function(data) {
-        if (data.reset) {
-            // 管理员清屏或版本不匹配，强制刷新群聊
-            // 设置管理员清空标志，防止显示对方离线弹窗
-            adminClearInProgress = true;
-            
-            handleVersionChange(data.version);
-            
-            // 强制回到群聊视图
-            currentView = 'group';
-            
-            // 清理界面
-            $('#image-modal').hide();
-            
-            // 延迟重置标志，确保所有检查都完成
-            setTimeout(function() {
-                adminClearInProgress = false;
-            }, 1000);
-            
-            // 不在此处递归调用，交给定时器下次轮询
-            return;
-        }
-        
-        if (data.version) {
-            version = data.version;
-        }
-        
-        if (data.list && data.list.length > 0) {
-            var currentCount = k || 0;
-            var newTotal = data.count || data.list.length;
-            var delta = newTotal - currentCount;
-            var $box = $('#chat-box');
-
-            // 如果最后一条消息未变化，则直接跳过渲染，避免重复闪烁
-            var incomingLastRaw = data.list[data.list.length - 1] || '';
-            if (lastMsgSignature && incomingLastRaw === lastMsgSignature && delta <= 0) {
-                // 无新增且尾部一致，不刷新
-                return;
-            }
-
-            // 情况1：版本回滚/清空（总数变小）或无已渲染内容 → 全量重绘
-            if (delta <= 0 || $box.children().length === 0) {
-                var fullHtml = [];
-                $.each(data.list, function(index, msgJson) {
-                    try {
-                        var msg = JSON.parse(msgJson);
-                        if (msg.type === 'sys') {
-                            fullHtml.push('<div class="tips tips-warning">' + msg.msg + '</div>');
-                        } else {
-                            var isSelf = (msg.key === key);
-                            var position = isSelf ? "right" : "left";
-                            var timestamp = msg.timestamp ? msg.timestamp : "";
-                            var contentHtml = (msg.type === 'file') ? generateFileHtml(msg.fileInfo) : convertLinksToHtml(msg.msg);
-                            if (!userColors[msg.name]) userColors[msg.name] = getRandomLightColor();
-                            var avatarColor = userColors[msg.name];
-                            var firstChar = msg.name.charAt(0).toUpperCase();
-                            var timestampHtml = timestamp ? '<div class="timestamp">' + timestamp + '</div>' : '';
-                            var selfClass = isSelf ? ' self-msg' : '';
-                            fullHtml.push('<div class="msg ' + position + selfClass + '">\
-<div class="msg-content">\
-<div class="avatar" style="background-color:' + avatarColor + '">' + firstChar + '</div>\
-<div class="msg-body">\
-<div class="username">' + msg.name + '</div>\
-<div class="message">' + contentHtml + '</div>' + timestampHtml + '\
-</div>\
-</div>\
-</div>');
-                        }
-                    } catch (e) { console.error("Error parsing message:", e); }
-                });
-                var shouldStickBottom = pendingSelfScroll || isAtBottom();
-                $box.empty().append(fullHtml.join(''));
-                if (shouldStickBottom) sockll();
-                pendingSelfScroll = false;
-            } else {
-                // 情况2：有新增消息，且新增数量小于100 → 仅追加尾部delta条
-                var toAppend = Math.min(delta, data.list.length);
-                var startIndex = Math.max(0, data.list.length - toAppend);
-                var appendHtml = [];
-                for (var i = startIndex; i < data.list.length; i++) {
-                    try {
-                        var aMsg = JSON.parse(data.list[i]);
-                        if (aMsg.type === 'sys') {
-                            appendHtml.push('<div class="tips tips-warning">' + aMsg.msg + '</div>');
-                        } else {
-                            var aSelf = (aMsg.key === key);
-                            var aPos = aSelf ? "right" : "left";
-                            var aTs = aMsg.timestamp ? aMsg.timestamp : "";
-                            var aContent = (aMsg.type === 'file') ? generateFileHtml(aMsg.fileInfo) : convertLinksToHtml(aMsg.msg);
-                            if (!userColors[aMsg.name]) userColors[aMsg.name] = getRandomLightColor();
-                            var aColor = userColors[aMsg.name];
-                            var aFirst = aMsg.name.charAt(0).toUpperCase();
-                            var aTsHtml = aTs ? '<div class="timestamp">' + aTs + '</div>' : '';
-                            var aSelfClass = aSelf ? ' self-msg' : '';
-                            appendHtml.push('<div class="msg ' + aPos + aSelfClass + '">\
-<div class="msg-content">\
-<div class="avatar" style="background-color:' + aColor + '">' + aFirst + '</div>\
-<div class="msg-body">\
-<div class="username">' + aMsg.name + '</div>\
-<div class="message">' + aContent + '</div>' + aTsHtml + '\
-</div>\
-</div>\
-</div>');
-                        }
-                    } catch (e) { console.error("Error parsing message:", e); }
-                }
-                if (appendHtml.length) {
-                    var shouldStick = pendingSelfScroll || isAtBottom();
-                    $box.append(appendHtml.join(''));
-                    if (shouldStick) sockll();
-                    pendingSelfScroll = false;
-                }
-                // 保持最多100条（包含tips和msg）
-                trimChatBoxTo(100);
-            }
-            // 记录最后一条签名与总数
-            lastMsgSignature = incomingLastRaw;
-            k = newTotal;
-        }
-        
-        if (data.users) {
-            chatUsers = Array.from(new Set(data.users));
-        }
-        adjustPollingInterval(data.list && data.list.length > 0); // 根据是否有新消息调整轮询间隔
+    var since = lastId;
+    $.getJSON("/msg?since=" + since + "&v=" + version, function(data) {
+        handleMsgData(data, since);
     }).fail(function(xhr, status, error) {
         // 网络错误时暂停轮询，并提供重试选项
         clearInterval(c);
+        c = null;
         
         // 根据错误类型提供不同的提示
         var errorMsg = '消息获取失败';
@@ -818,6 +703,9 @@ function get_msg() {
         addtip(errorMsg + '，<a class="fresh-retry" href="javascript:;">点击重试</a>', 'tips-warning');
         // 使用事件委托并去重绑定
         $(document).off('click.fresh', '.fresh-retry').on('click.fresh', '.fresh-retry', function() {
+            $(this).closest('.tips').remove();
+            // 长轮询已恢复时由它继续拉取，不再另起定时器
+            if (longPollActive) return;
             pollingConfig.currentInterval = 2000;
             pollingConfig.consecutiveEmptyResponses = 0;
             get_msg();
@@ -831,6 +719,151 @@ function get_msg() {
     });
 }
 
+// 处理 /msg 与 /msg/wait 的响应
+function handleMsgData(data, since) {
+    // 请求发出后已有其他响应推进了 lastId（或重置），这份结果已过期，丢弃以免重复渲染
+    if (since !== lastId) {
+        return;
+    }
+    if (data.reset) {
+        // 服务端 last_id 比本地还小：消息 id 回退（服务异常退出），同版本也要重置
+        var idsWentBack = typeof data.last_id === 'number' && data.last_id < since;
+        if (data.version === version && !idsWentBack) {
+            // 本地已同步到该版本（如刚上传完文件），无需重置
+            return;
+        }
+        // 管理员清屏或版本不匹配，强制刷新群聊
+        // 设置管理员清空标志，防止显示对方离线弹窗
+        adminClearInProgress = true;
+        
+        handleVersionChange(data.version);
+        
+        // 强制回到群聊视图
+        currentView = 'group';
+        
+        // 清理界面
+        $('#image-modal').hide();
+        
+        // 延迟重置标志，确保所有检查都完成
+        setTimeout(function() {
+            adminClearInProgress = false;
+        }, 1000);
+        
+        // 不在此处递归调用，交给下次轮询
+        return;
+    }
+    
+    if (data.version) {
+        version = data.version;
+    }
+    
+    if (data.list && data.list.length > 0) {
+        var $box = $('#chat-box');
+        var html = [];
+        $.each(data.list, function(index, msgJson) {
+            html.push(renderChatMessage(msgJson));
+        });
+        var shouldStickBottom = pendingSelfScroll || isAtBottom();
+        // since=0（首次拉取或重置后）服务端返回最近100条，其余情况仅有新增消息
+        $box.append(html.join(''));
+        if (shouldStickBottom) sockll();
+        pendingSelfScroll = false;
+        // 保持最多100条（包含tips和msg）
+        trimChatBoxTo(100);
+        k += data.list.length;
+    }
+    if (typeof data.last_id === 'number') {
+        lastId = data.last_id;
+    }
+    
+    if (data.users) {
+        chatUsers = Array.from(new Set(data.users));
+    }
+    if (c) {
+        adjustPollingInterval(data.list && data.list.length > 0); // 根据是否有新消息调整轮询间隔
+    }
+}
+
+// ===== 长轮询：服务端有新消息时立即返回，心跳随请求一并刷新 =====
+var longPollEnabled = false; // 登录后开启，退出后关闭
+var longPollActive = false;
+var longPollRetryDelay = 1000;
+
+function startLongPoll() {
+    if (!longPollEnabled || longPollActive) return;
+    longPollActive = true;
+    if (c) {
+        clearInterval(c);
+        c = null;
+    }
+    long_poll();
+}
+
+// 服务端等待名额已满或连续出错：退回定时轮询，稍后再尝试长轮询
+function fallbackToPolling(retryAfterMs) {
+    longPollActive = false;
+    if (!c) {
+        c = setInterval(get_msg, pollingConfig.currentInterval);
+    }
+    setTimeout(startLongPoll, retryAfterMs);
+}
+
+function long_poll() {
+    if (!longPollActive) return;
+    var since = lastId;
+    $.ajax({
+        url: "/msg/wait?since=" + since + "&v=" + version,
+        dataType: "json",
+        timeout: 40000
+    }).done(function(data) {
+        longPollRetryDelay = 1000;
+        if (data.busy) {
+            fallbackToPolling(30000);
+            return;
+        }
+        handleMsgData(data, since);
+        long_poll();
+    }).fail(function() {
+        longPollRetryDelay = Math.min(longPollRetryDelay * 2, 16000);
+        if (longPollRetryDelay >= 16000) {
+            fallbackToPolling(60000);
+            return;
+        }
+        setTimeout(long_poll, longPollRetryDelay);
+    });
+}
+
+// 将一条原始消息 JSON 渲染为 HTML
+function renderChatMessage(msgJson) {
+    try {
+        var msg = JSON.parse(msgJson);
+        if (msg.type === 'sys') {
+            return '<div class="tips tips-warning">' + msg.msg + '</div>';
+        }
+        var isSelf = (msg.key === key);
+        var position = isSelf ? "right" : "left";
+        var timestamp = msg.timestamp ? msg.timestamp : "";
+        var contentHtml = (msg.type === 'file') ? generateFileHtml(msg.fileInfo) : convertLinksToHtml(msg.msg);
+        if (!userColors[msg.name]) userColors[msg.name] = getRandomLightColor();
+        var avatarColor = userColors[msg.name];
+        var firstChar = msg.name.charAt(0).toUpperCase();
+        var timestampHtml = timestamp ? '<div class="timestamp">' + timestamp + '</div>' : '';
+        var selfClass = isSelf ? ' self-msg' : '';
+        return '<div class="msg ' + position + selfClass + '">\
+<div class="msg-content">\
+<div class="avatar" style="background-color:' + avatarColor + '">' + firstChar + '</div>\
+<div class="msg-body">\
+<div class="username">' + msg.name + '</div>\
+<div class="message">' + contentHtml + '</div>' + timestampHtml + '\
+</div>\
+</div>\
+</div>';
+    } catch (e) {
+        console.error("Error parsing message:", e);
+        return '';
+    }
+}
+
 // 限制聊天列表DOM数量，避免长时间运行卡顿
 function trimChatBox(maxNodes) {
     var $box = $('#chat-box');
@@ -854,6 +887,7 @@ function trimChatBoxTo(maxNodes) {
 function handleVersionChange(newVersion) {
     $('#chat-box').empty();
     k = 0;
+    lastId = 0;
     version = newVersion;
     addtip('聊天记录已刷新', 'tips-warning');
 }
@@ -989,8 +1023,8 @@ function login() {
             
             
             
-            get_msg();
-            c = setInterval(get_msg, pollingConfig.currentInterval);
+            longPollEnabled = true;
+            startLongPoll();
             h = setInterval(sendHeartbeat, heartbeatInterval);
         },
         error: function(xhr) {
@@ -1,8 +1,24 @@
 import { els, showToast, setActiveView } from './dom.js';
 import { focusChat } from './ai_chat.js';
-import { fetchJSON } from './utils.js';
+import { fetchJSON, normalizeWord } from './utils.js';
 import { renderLookupCard, renderLookupError, renderLookupNotFound } from './lookup.js';
 
+// 当前文件的查词结果缓存：normalized -> row；missing 记录确定未收录的词
+const lookupCache = new Map();
+const lookupMissing = new Set();
+
+async function prefetchLookups(name) {
+  try {
+    const data = await fetchJSON(`/api/txt/lookups?name=${encodeURIComponent(name)}`);
+    lookupCache.clear();
+    lookupMissing.clear();
+    Object.entries(data.results || {}).forEach(([norm, row]) => lookupCache.set(norm, row));
+    (data.missing || []).forEach((norm) => lookupMissing.add(norm));
+  } catch {
+    // 预热失败不影响逐词查询
+  }
+}
+
 function parseMarkedTokens(text) {
   const parts = [];
   let lastIndex = 0;
@@ -23,13 +39,27 @@ function parseMarkedTokens(text) {
 }
 
 export function renderSentenceCenter(text) {
+  renderParts(parseMarkedTokens(text || ''), String(text || ''));
+}
+
+// 服务端预切分的片段（format=tokens）：[[标记]] 已拆好，text 段里的普通单词仍由前端切分
+export function renderSentenceSegments(segments) {
+  const parts = Array.isArray(segments) ? segments : [];
+  // id 为 null 表示词典确定未收录：预热返回前点击也直接交给智能体；没有 id 字段说明词典尚未加载
+  parts.forEach((part) => {
+    if (part.type === 'token' && part.id === null) lookupMissing.add(part.norm || normalizeWord(part.word));
+  });
+  const text = parts.map((part) => (part.type === 'token' ? `[[${part.word}]]` : part.value || '')).join('');
+  renderParts(parts, text);
+}
+
+function renderParts(parts, fullText) {
   if (!els.content) return;
-  window.__currentTxtFull = String(text || '');
+  window.__currentTxtFull = fullText;
   if (!window.__currentTxtName) {
     // 保底：若未在列表点击时设置名称，则使用默认
     window.__currentTxtName = '全文';
   }
-  const parts = parseMarkedTokens(text || '');
   const container = document.createElement('div');
   container.className = 'sentence';
   for (const part of parts) {
@@ -66,20 +96,23 @@ function renderTextWithClickableWords(text) {
     if (start > lastIndex) {
       fragment.appendChild(document.createTextNode(source.slice(lastIndex, start)));
     }
-    const word = match[0];
-    const span = document.createElement('span');
-    span.className = 'word-click';
-    span.textContent = word;
-    span.dataset.word = word;
-    span.title = `查询：${word}`;
-    span.addEventListener('click', () => onTokenClick(word));
-    fragment.appendChild(span);
+    fragment.appendChild(createWordSpan(match[0]));
     lastIndex = end;
   }
   if (lastIndex < source.length) fragment.appendChild(document.createTextNode(source.slice(lastIndex)));
   return fragment;
 }
 
+function createWordSpan(word) {
+  const span = document.createElement('span');
+  span.className = 'word-click';
+  span.textContent = word;
+  span.dataset.word = word;
+  span.title = `查询：${word}`;
+  span.addEventListener('click', () => onTokenClick(word));
+  return span;
+}
+
 function fallbackToAI(word) {
   try {
     focusChat();
@@ -100,6 +133,15 @@ function fallbackToAI(word) {
 }
 
 async function lookupWord(word) {
+  const norm = normalizeWord(word);
+  if (lookupCache.has(norm)) {
+    renderLookupCard(word, '', 0, lookupCache.get(norm));
+    return;
+  }
+  if (lookupMissing.has(norm)) {
+    fallbackToAI(word);
+    return;
+  }
   try {
     const data = await fetchJSON(`/api/lookup?word=${encodeURIComponent(word)}`);
     if (!data || !data.row) {
@@ -107,6 +149,7 @@ async function lookupWord(word) {
       fallbackToAI(word);
       return;
     }
+    lookupCache.set(norm, data.row);
     renderLookupCard(word, '', 0, data.row);
   } catch (err) {
     // 404 或其他错误：同样走智能体兜底
@@ -130,12 +173,16 @@ export async function loadTxtList() {
       tile.addEventListener('click', async (event) => {
         event.preventDefault();
         try {
-          const data = await fetchJSON(`/api/txt/content?name=${encodeURIComponent(name)}`);
-          const text = (data.content || '').trim();
+          const data = await fetchJSON(`/api/txt/content?name=${encodeURIComponent(name)}&format=tokens`);
           const baseName = String(name).replace(/\.[^.]+$/, '');
           // 移除确认窗口，改用Toast通知
-          renderSentenceCenter(text);
+          if (Array.isArray(data.segments)) {
+            renderSentenceSegments(data.segments);
+          } else {
+            renderSentenceCenter((data.content || '').trim());
+          }
           window.__currentTxtName = baseName;
+          prefetchLookups(name);
           if (activeTile && activeTile !== tile) {
             activeTile.classList.remove('active');
           }
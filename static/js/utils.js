@@ -4,6 +4,15 @@ export async function fetchJSON(url, options) {
   return response.json();
 }
 
+// 与后端 normalize_word 保持一致
+export function normalizeWord(word) {
+  return String(word || '')
+    .trim()
+    .replace(/[^A-Za-z\-']+/g, ' ')
+    .trim()
+    .toLowerCase();
+}
+
 export function escapeHtml(value) {
   return String(value || '')
     .replace(/&/g, '&amp;')